@@ -0,0 +1,33 @@
+"""
+Caricamento condiviso degli step di un funnel per le pagine Streamlit.
+La configurazione UI legge gli step da qui, la gestione degli step svuota la cache dopo ogni modifica.
+"""
+
+from typing import Any, Dict, List, Tuple
+
+import streamlit as st
+
+from db import step_operations
+
+
+@st.cache_data(ttl=120, show_spinner=False)
+def cached_funnel_steps(funnel_id: int) -> Tuple[List[Dict[str, Any]], Dict[int, str]]:
+    """
+    Recupera gli step di un funnel con la mappa ID -> etichetta per i selectbox.
+
+    Args:
+        funnel_id (int): ID del funnel
+
+    Returns:
+        Tuple[List[Dict[str, Any]], Dict[int, str]]: Step del funnel ed etichette per ID
+    """
+    steps = step_operations.get_steps_by_funnel(funnel_id) or []
+    step_labels = {step["id"]: f"{step['order']}. {step['name']}" for step in steps}
+    return steps, step_labels
+
+
+def clear_funnel_steps_cache() -> None:
+    """
+    Svuota la cache degli step dei funnel dopo una modifica agli step.
+    """
+    cached_funnel_steps.clear()
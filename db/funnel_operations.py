@@ -107,6 +107,52 @@ def get_funnel_by_product_id(product_id: int) -> Optional[Dict[str, Any]]:
         close_db_session(session)
 
 
+def get_funnels_by_product_id() -> Dict[int, Dict[str, Any]]:
+    """
+    Recupera tutti i funnel indicizzati per ID del prodotto.
+
+    Restituisce gli stessi campi di get_funnel_by_product_id, ma con una sola
+    query per l'intero catalogo.
+
+    Returns:
+        Dict[int, Dict[str, Any]]: Dizionario product_id -> dati del funnel.
+    """
+    session = get_db_session()
+    try:
+        log_operation("Recupero funnel per tutti i prodotti", level=logging.INFO)
+
+        results = session.execute(
+            select(
+                Funnel.id,
+                Funnel.name,
+                Funnel.workflow_id,
+                Funnel.broker_id,
+                Funnel.product_id,
+                Workflow.description.label("workflow_description"),
+            ).join(Workflow, Funnel.workflow_id == Workflow.id)
+        ).all()
+
+        funnels = {
+            row.product_id: {
+                "id": row.id,
+                "name": row.name,
+                "workflow_id": row.workflow_id,
+                "broker_id": row.broker_id,
+                "workflow_description": row.workflow_description,
+            }
+            for row in results
+        }
+
+        log_operation("Recupero funnel per tutti i prodotti", {"count": len(funnels)})
+        return funnels
+    except Exception as e:
+        return handle_error(
+            e, "Errore durante il recupero dei funnel per prodotto", fallback_data={}
+        ).get("data", {})
+    finally:
+        close_db_session(session)
+
+
 def create_product_funnel(
     product_id: int, product_name: str, default_broker_id: Optional[int] = None
 ) -> Dict[str, Any]:
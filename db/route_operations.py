@@ -1,5 +1,6 @@
 import json
 import logging
+from functools import lru_cache
 
 from sqlalchemy import delete, insert, select, update
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
@@ -99,6 +100,7 @@ def create_route(workflow_id, from_step_id, next_step_id, route_config=None):
         route_stmt = insert(Route).values(**route_data)
         route_result = session.execute(route_stmt)
         session.commit()
+        clear_routes_cache()
 
         route_id = route_result.inserted_primary_key[0]
 
@@ -126,6 +128,9 @@ def create_route(workflow_id, from_step_id, next_step_id, route_config=None):
 def get_routes_for_workflow(workflow_id):
     """Recupera tutte le route associate a un workflow.
 
+    Il risultato è condiviso dalla cache del processo: va trattato in sola
+    lettura.
+
     Args:
         workflow_id (int): ID del workflow.
 
@@ -134,8 +139,25 @@ def get_routes_for_workflow(workflow_id):
         None: In caso di errore.
     """
     try:
-        session = get_db_session()
+        return _fetch_routes(workflow_id)
+    except SQLAlchemyError as e:
+        logger.error(
+            f"Errore nel recupero delle route per il workflow {workflow_id}: {e}"
+        )
+        return None
 
+
+def clear_routes_cache():
+    """Svuota la cache delle route dopo una modifica al database."""
+    _fetch_routes.cache_clear()
+
+
+@lru_cache(maxsize=256)
+def _fetch_routes(workflow_id):
+    """Esegue la query delle route di un workflow; gli errori non vengono
+    memorizzati in cache perché l'eccezione risale al chiamante."""
+    session = get_db_session()
+    try:
         # Recupera tutte le route del workflow con i dati degli step associati
         # Definiamo esplicitamente l'alias per il next_step
         next_step_alias = aliased(Step, name="next_step_alias")
@@ -161,7 +183,7 @@ def get_routes_for_workflow(workflow_id):
         ).all()
 
         # Converti i risultati in una lista di dizionari
-        result = [
+        return [
             {
                 "id": route.id,
                 "workflow_id": route.workflow_id,
@@ -179,13 +201,6 @@ def get_routes_for_workflow(workflow_id):
             }
             for route in routes
         ]
-
-        return result
-    except SQLAlchemyError as e:
-        logger.error(
-            f"Errore nel recupero delle route per il workflow {workflow_id}: {e}"
-        )
-        return None
     finally:
         close_db_session(session)
 
@@ -213,6 +228,7 @@ def delete_route(route_id):
         # Elimina la route
         session.execute(delete(Route).where(Route.id == route_id))
         session.commit()
+        clear_routes_cache()
 
         return {"error": False, "message": f"Route eliminata con successo"}
     except SQLAlchemyError as e:
@@ -224,3 +240,38 @@ def delete_route(route_id):
         }
     finally:
         close_db_session(session)
+
+
+def delete_routes(route_ids):
+    """Elimina più route con un'unica istruzione DELETE.
+
+    Args:
+        route_ids (list[int]): ID delle route da eliminare.
+
+    Returns:
+        dict: Dizionario contenente un messaggio di successo in caso di successo.
+        dict: Dizionario contenente un messaggio di errore in caso di fallimento.
+    """
+    if not route_ids:
+        return {"error": True, "message": "Nessuna route selezionata"}
+
+    session = get_db_session()
+    try:
+        # Elimina tutte le route in una sola transazione
+        result = session.execute(delete(Route).where(Route.id.in_(route_ids)))
+        session.commit()
+        clear_routes_cache()
+
+        return {
+            "error": False,
+            "message": f"{result.rowcount} route eliminate con successo",
+        }
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Errore nell'eliminazione delle route: {e}")
+        return {
+            "error": True,
+            "message": f"Errore nell'eliminazione delle route: {str(e)}",
+        }
+    finally:
+        close_db_session(session)
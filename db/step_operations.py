@@ -1,10 +1,11 @@
 import json
 import logging
 
-from sqlalchemy import delete, insert, select, update
+from sqlalchemy import delete, func, insert, select, update
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
 from db.models import Funnel, OrderFunnel, Route, Step, Workflow
+from db.route_operations import clear_routes_cache
 from utils.db_utils import close_db_session, get_db_session
 
 # Configurazione del logging
@@ -100,8 +101,12 @@ def create_step(
         close_db_session(session)
 
 
-def get_steps():
-    """Recupera tutti gli step esistenti.
+def get_steps(offset=None, limit=None):
+    """Recupera gli step esistenti, eventualmente una pagina alla volta.
+
+    Args:
+        offset (int, optional): Numero di step da saltare.
+        limit (int, optional): Numero massimo di step da restituire.
 
     Returns:
         list: Lista di dizionari contenenti i dati degli step.
@@ -110,9 +115,10 @@ def get_steps():
     try:
         session = get_db_session()
         steps = session.execute(
-            select(Step.id, Step.step_url, Step.step_code, Step.post_message).order_by(
-                Step.step_url
-            )
+            select(Step.id, Step.step_url, Step.step_code, Step.post_message)
+            .order_by(Step.step_url)
+            .offset(offset)
+            .limit(limit)
         ).all()
 
         # Converti i risultati in una lista di dizionari
@@ -134,6 +140,23 @@ def get_steps():
         close_db_session(session)
 
 
+def count_steps():
+    """Conta gli step esistenti.
+
+    Returns:
+        int: Numero totale di step.
+        None: In caso di errore.
+    """
+    try:
+        session = get_db_session()
+        return session.execute(select(func.count(Step.id))).scalar_one()
+    except SQLAlchemyError as e:
+        logger.error(f"Errore nel conteggio degli step: {e}")
+        return None
+    finally:
+        close_db_session(session)
+
+
 def get_steps_for_workflow(workflow_id):
     """Recupera gli step associati alle route di un dato workflow.
 
@@ -279,6 +302,8 @@ def update_step(
         # Aggiorna lo step
         session.execute(update(Step).where(Step.id == step_id).values(**update_data))
         session.commit()
+        # Le route in cache riportano URL e codice dello step
+        clear_routes_cache()
 
         # Recupera lo step aggiornato
         updated_step = session.execute(
@@ -1,9 +1,8 @@
-import json
 import logging
+from itertools import groupby
 
-from sqlalchemy import desc, func
+from sqlalchemy import func
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import aliased, joinedload
 
 from db.models import (
     CmsKey,
@@ -14,8 +13,9 @@ from db.models import (
     Structure,
     StructureComponentSection,
 )
-from utils.db_utils import close_db_session, get_db_session
-from utils.db_transaction import standardized_db_operation, log_db_operation, with_retry
+from utils import json_utils
+from utils.db_utils import get_db_session
+from utils.db_transaction import standardized_db_operation, log_db_operation
 
 # Configurazione del logging
 logger = logging.getLogger(__name__)
@@ -72,14 +72,20 @@ def create_section(sectiontype):
         session.close()
 
 
-def get_sections():
+def get_sections(session=None):
     """
     Recupera tutte le sezioni dal database
 
+    Args:
+        session (Session, optional): Sessione già aperta da riutilizzare;
+            se assente ne viene aperta e chiusa una apposita
+
     Returns:
         list: Lista di dizionari contenenti i dati delle sezioni
     """
-    session = get_db_session()
+    owns_session = session is None
+    if owns_session:
+        session = get_db_session()
     try:
         sections = session.query(Section).all()
 
@@ -94,7 +100,8 @@ def get_sections():
         logger.error(f"Errore nel recupero delle sezioni: {error_message}")
         return []
     finally:
-        session.close()
+        if owns_session:
+            session.close()
 
 
 # Operazioni per i componenti
@@ -153,14 +160,20 @@ def create_component(component_type):
         session.close()
 
 
-def get_components():
+def get_components(session=None):
     """
     Recupera tutti i componenti dal database
 
+    Args:
+        session (Session, optional): Sessione già aperta da riutilizzare;
+            se assente ne viene aperta e chiusa una apposita
+
     Returns:
         list: Lista di dizionari contenenti i dati dei componenti
     """
-    session = get_db_session()
+    owns_session = session is None
+    if owns_session:
+        session = get_db_session()
     try:
         components = session.query(Component).all()
 
@@ -177,7 +190,8 @@ def get_components():
         logger.error(f"Errore nel recupero dei componenti: {error_message}")
         return []
     finally:
-        session.close()
+        if owns_session:
+            session.close()
 
 
 # Operazioni per l'associazione di sezioni a step
@@ -251,7 +265,7 @@ def add_section_to_step(step_id, section_id, order, product_id=None, broker_id=N
         session.close()
 
 
-def get_sections_for_step(step_id, product_id=None, broker_id=None):
+def get_sections_for_step(step_id, product_id=None, broker_id=None, session=None):
     """
     Recupera tutte le sezioni associate a uno step specifico.
 
@@ -259,11 +273,16 @@ def get_sections_for_step(step_id, product_id=None, broker_id=None):
         step_id (int): ID dello step
         product_id (int, optional): ID del prodotto per filtrare le sezioni
         broker_id (int, optional): ID del broker per filtrare le sezioni
+        session (Session, optional): Sessione già aperta da riutilizzare;
+            se assente ne viene aperta e chiusa una apposita
 
     Returns:
-        list: Lista di sezioni associate allo step in formato dizionario
+        list: Lista di sezioni associate allo step in formato dizionario,
+            ordinata per "order" crescente
     """
-    session = get_db_session()
+    owns_session = session is None
+    if owns_session:
+        session = get_db_session()
     try:
         query = (
             session.query(StepSection, Section)
@@ -283,7 +302,8 @@ def get_sections_for_step(step_id, product_id=None, broker_id=None):
                 (StepSection.brokerid == broker_id) | (StepSection.brokerid == None)
             )
 
-        results = query.all()
+        # L'ordinamento è garantito dal database: i chiamanti non devono riordinare
+        results = query.order_by(StepSection.order, StepSection.id).all()
 
         sections = []
         for step_section, section in results:
@@ -305,6 +325,37 @@ def get_sections_for_step(step_id, product_id=None, broker_id=None):
         error_message = str(e)
         logger.error(f"Errore nel recupero delle sezioni per lo step: {error_message}")
         return []
+    finally:
+        if owns_session:
+            session.close()
+
+
+def next_section_order(step_id, product_id=None):
+    """
+    Calcola l'ordine da assegnare alla prossima sezione di uno step
+
+    Args:
+        step_id (int): ID dello step
+        product_id (int, optional): ID del prodotto, con lo stesso filtro di get_sections_for_step
+
+    Returns:
+        int: MAX(order) + 1 delle sezioni dello step, 1 se non ce ne sono
+    """
+    session = get_db_session()
+    try:
+        query = session.query(func.coalesce(func.max(StepSection.order), 0) + 1).filter(
+            StepSection.stepid == step_id
+        )
+        if product_id is not None:
+            query = query.filter(
+                (StepSection.productid == product_id) | (StepSection.productid == None)
+            )
+        return query.scalar()
+
+    except SQLAlchemyError as e:
+        error_message = str(e)
+        logger.error(f"Errore nel calcolo dell'ordine della sezione: {error_message}")
+        return 1
     finally:
         session.close()
 
@@ -469,7 +520,8 @@ def get_components_for_section(section_id):
         section_id (int): ID della sezione
 
     Returns:
-        list: Lista di componenti associati alla sezione in formato dizionario
+        list: Lista di componenti associati alla sezione in formato dizionario,
+            ordinata per "order" crescente
     """
     # Funzione interna che esegue l'operazione con una sessione
     @standardized_db_operation("recupero componenti per sezione")
@@ -497,6 +549,16 @@ def get_components_for_section(section_id):
 
         results = query.all()
 
+        # Recupera con un'unica query le chiavi CMS di tutti i componenti
+        cms_keys = _query_cms_keys(
+            session,
+            [
+                structure_component_section.id
+                for _, _, _, structure_component_section in results
+                if structure_component_section
+            ],
+        )
+
         components = []
         for (
             component_section,
@@ -507,9 +569,7 @@ def get_components_for_section(section_id):
             # Recupera la chiave CMS associata, se presente
             cms_key = None
             if structure_component_section:
-                cms_key = session.query(CmsKey).filter(
-                    CmsKey.structurecomponentsectionid == structure_component_section.id
-                ).first()
+                cms_key = cms_keys.get(structure_component_section.id)
 
             component_data = {
                 "id": component.id,
@@ -517,6 +577,12 @@ def get_components_for_section(section_id):
                 "component_section_id": component_section.id,
                 "order": component_section.order,
                 "structure": structure.data if structure else None,
+                # Serializzata qui una volta, pronta per l'editor JSON
+                "structure_json": (
+                    json_utils.dumps(structure.data, indent=True)
+                    if structure and structure.data
+                    else None
+                ),
                 "structure_id": structure.id if structure else None,
                 "structure_component_section_id": (
                     structure_component_section.id
@@ -534,6 +600,32 @@ def get_components_for_section(section_id):
     return _get_components_for_section(section_id)
 
 
+def next_component_order(section_id):
+    """
+    Calcola l'ordine da assegnare al prossimo componente di una sezione
+
+    Args:
+        section_id (int): ID della sezione
+
+    Returns:
+        int: MAX(order) + 1 dei componenti della sezione, 1 se non ce ne sono
+    """
+    session = get_db_session()
+    try:
+        return (
+            session.query(func.coalesce(func.max(ComponentSection.order), 0) + 1)
+            .filter(ComponentSection.sectionid == section_id)
+            .scalar()
+        )
+
+    except SQLAlchemyError as e:
+        error_message = str(e)
+        logger.error(f"Errore nel calcolo dell'ordine del componente: {error_message}")
+        return 1
+    finally:
+        session.close()
+
+
 def update_component_section_order(component_section_id, new_order):
     """
     Aggiorna l'ordine di un componente all'interno di una sezione
@@ -794,3 +886,135 @@ def get_cms_key_for_structure(structure_component_section_id):
 
     # Chiama la funzione interna
     return _get_cms_key_for_structure(structure_component_section_id)
+
+
+def _query_cms_keys(session, structure_component_section_ids):
+    """
+    Recupera con un'unica query le chiavi CMS di più strutture.
+
+    Args:
+        session: Sessione del database
+        structure_component_section_ids (list): ID delle associazioni struttura-componente-sezione
+
+    Returns:
+        dict: Mappa ID associazione -> oggetto CmsKey (la prima per ID, come .first())
+    """
+    if not structure_component_section_ids:
+        return {}
+
+    cms_keys = (
+        session.query(CmsKey)
+        .filter(
+            CmsKey.structurecomponentsectionid.in_(structure_component_section_ids)
+        )
+        .order_by(CmsKey.id)
+        .all()
+    )
+    cms_keys_by_structure = {}
+    for cms_key in cms_keys:
+        cms_keys_by_structure.setdefault(cms_key.structurecomponentsectionid, cms_key)
+    return cms_keys_by_structure
+
+
+def get_preview_tree(step_id, product_id=None, include_cms=True, session=None):
+    """
+    Recupera con un'unica query sezioni, componenti e strutture di uno step, già
+    ordinati per l'anteprima; le chiavi CMS arrivano da una seconda query aggregata.
+
+    Args:
+        step_id (int): ID dello step
+        product_id (int, optional): ID del prodotto per filtrare le sezioni
+        include_cms (bool): Se False, le chiavi CMS non vengono recuperate
+        session (Session, optional): Sessione già aperta da riutilizzare;
+            se assente ne viene aperta e chiusa una apposita
+
+    Returns:
+        list: Lista di sezioni in formato dizionario, ognuna con la lista "components"
+    """
+    owns_session = session is None
+    if owns_session:
+        session = get_db_session()
+    try:
+        query = (
+            session.query(
+                StepSection,
+                Section,
+                ComponentSection,
+                Component,
+                StructureComponentSection,
+                Structure,
+            )
+            .join(Section, StepSection.sectionid == Section.id)
+            .outerjoin(ComponentSection, ComponentSection.sectionid == Section.id)
+            .outerjoin(Component, ComponentSection.componentid == Component.id)
+            .outerjoin(
+                StructureComponentSection,
+                ComponentSection.id == StructureComponentSection.component_sectionid,
+            )
+            .outerjoin(Structure, StructureComponentSection.structureid == Structure.id)
+            .filter(StepSection.stepid == step_id)
+        )
+
+        # Filtra per prodotto se specificato
+        if product_id is not None:
+            query = query.filter(
+                (StepSection.productid == product_id) | (StepSection.productid == None)
+            )
+
+        query = query.order_by(
+            StepSection.order, StepSection.id, ComponentSection.order
+        )
+
+        rows_all = query.all()
+
+        # Chiavi CMS recuperate a parte: una join moltiplicherebbe le righe dei
+        # componenti quando una struttura ha più chiavi
+        cms_keys = {}
+        if include_cms:
+            cms_keys = _query_cms_keys(
+                session, [row[4].id for row in rows_all if row[4] is not None]
+            )
+
+        # Le righe arrivano ordinate per sezione: groupby le raggruppa senza riordinare
+        tree = []
+        for _, rows in groupby(rows_all, key=lambda row: row[0].id):
+            rows = list(rows)
+            step_section, section = rows[0][0], rows[0][1]
+
+            components = []
+            for row in rows:
+                component_section, component, structure = row[2], row[3], row[5]
+                if component_section is None:
+                    continue
+                cms_key = cms_keys.get(row[4].id) if row[4] is not None else None
+                components.append(
+                    {
+                        "id": component.id,
+                        "component_type": component.component_type,
+                        "component_section_id": component_section.id,
+                        "order": component_section.order,
+                        "structure": structure.data if structure else None,
+                        "cms_key": cms_key.value if cms_key else None,
+                        "cms_key_id": cms_key.id if cms_key else None,
+                    }
+                )
+
+            tree.append(
+                {
+                    "id": section.id,
+                    "sectiontype": section.sectiontype,
+                    "step_section_id": step_section.id,
+                    "order": step_section.order,
+                    "components": components,
+                }
+            )
+
+        return tree
+
+    except SQLAlchemyError as e:
+        error_message = str(e)
+        logger.error(f"Errore nel recupero dell'anteprima per lo step: {error_message}")
+        return []
+    finally:
+        if owns_session:
+            session.close()
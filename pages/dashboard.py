@@ -3,6 +3,7 @@ Dashboard per visualizzare metriche e grafici relativi ai funnel.
 """
 
 import logging
+import time
 from typing import Any, Dict, List, Optional, Tuple
 
 import altair as alt
@@ -18,6 +19,129 @@ from utils.error_handler import handle_error, log_operation
 # Configurazione del logging
 logger = logging.getLogger(__name__)
 
+# Query testuali compilate una sola volta all'import del modulo
+_Q_AVG_STEPS_PER_FUNNEL = text(
+    """
+    SELECT AVG(step_count) as average_steps
+    FROM (
+        SELECT f.id as funnel_id, COUNT(DISTINCT r.nextstep_id) as step_count
+        FROM funnel_manager.funnel f
+        JOIN funnel_manager.workflow w ON f.workflow_id = w.id
+        LEFT JOIN funnel_manager.route r ON w.id = r.workflow_id
+        GROUP BY f.id
+    ) as step_counts
+"""
+)
+
+_Q_AVG_ROUTES_PER_FUNNEL = text(
+    """
+    SELECT AVG(route_count) as average_routes
+    FROM (
+        SELECT f.id as funnel_id, COUNT(r.id) as route_count
+        FROM funnel_manager.funnel f
+        JOIN funnel_manager.workflow w ON f.workflow_id = w.id
+        LEFT JOIN funnel_manager.route r ON w.id = r.workflow_id
+        GROUP BY f.id
+    ) as route_counts
+"""
+)
+
+_Q_LATEST_FUNNELS = text(
+    """
+    SELECT f.id, f.name, p.title_prod as product_name, p.id as product_id
+    FROM funnel_manager.funnel f
+    JOIN product.products p ON f.product_id = p.id
+    ORDER BY f.id DESC
+    LIMIT 5
+"""
+)
+
+_Q_FUNNEL_DETAILS = text(
+    """
+    SELECT f.id, f.name, p.title_prod as product_name, w.id as workflow_id
+    FROM funnel_manager.funnel f
+    JOIN product.products p ON f.product_id = p.id
+    JOIN funnel_manager.workflow w ON f.workflow_id = w.id
+    WHERE f.id = :funnel_id
+"""
+)
+
+_Q_FUNNEL_STEPS = text(
+    """
+    SELECT DISTINCT s.id, s.step_url, s.step_code
+    FROM funnel_manager.step s
+    JOIN funnel_manager.route r ON s.id = r.nextstep_id OR s.id = r.fromstep_id
+    WHERE r.workflow_id = :workflow_id
+"""
+)
+
+_Q_FUNNEL_ROUTES = text(
+    """
+    SELECT
+        r.id,
+        fs.step_url as from_step_url,
+        ns.step_url as to_step_url,
+        fs.id as from_step_id,
+        ns.id as to_step_id
+    FROM funnel_manager.route r
+    LEFT JOIN funnel_manager.step fs ON r.fromstep_id = fs.id
+    LEFT JOIN funnel_manager.step ns ON r.nextstep_id = ns.id
+    WHERE r.workflow_id = :workflow_id
+"""
+)
+
+_Q_TOP_FUNNELS = text(
+    """
+    SELECT
+        f.id,
+        f.name,
+        p.title_prod as product_name,
+        COUNT(DISTINCT s.id) as step_count
+    FROM funnel_manager.funnel f
+    JOIN product.products p ON f.product_id = p.id
+    JOIN funnel_manager.workflow w ON f.workflow_id = w.id
+    JOIN funnel_manager.route r ON w.id = r.workflow_id
+    JOIN funnel_manager.step s ON r.fromstep_id = s.id OR r.nextstep_id = s.id
+    GROUP BY f.id, f.name, p.title_prod
+    ORDER BY step_count DESC
+    LIMIT 5
+"""
+)
+
+_Q_FUNNEL_DISTRIBUTION = text(
+    """
+    SELECT
+        step_count,
+        COUNT(*) as funnel_count
+    FROM (
+        SELECT
+            f.id,
+            COUNT(DISTINCT s.id) as step_count
+        FROM funnel_manager.funnel f
+        JOIN funnel_manager.workflow w ON f.workflow_id = w.id
+        LEFT JOIN funnel_manager.route r ON w.id = r.workflow_id
+        LEFT JOIN funnel_manager.step s ON r.fromstep_id = s.id OR r.nextstep_id = s.id
+        GROUP BY f.id
+    ) as step_counts
+    GROUP BY step_count
+    ORDER BY step_count
+"""
+)
+
+_Q_PRODUCT_DISTRIBUTION = text(
+    """
+    SELECT
+        p.title_prod,
+        COUNT(f.id) as funnel_count
+    FROM funnel_manager.funnel f
+    JOIN product.products p ON f.product_id = p.id
+    GROUP BY p.title_prod
+    ORDER BY funnel_count DESC
+    LIMIT 10
+"""
+)
+
+
 # Configurazione della pagina
 st.set_page_config(
     page_title="Dashboard",
@@ -40,7 +164,7 @@ def get_system_stats():
             products_count = (
                 optimize_query_execution(
                     session, select(func.count(Product.id)), "conteggio prodotti"
-                ).scalar()
+                ).scalar_one_or_none()
                 or 0
             )
 
@@ -48,7 +172,7 @@ def get_system_stats():
             funnels_count = (
                 optimize_query_execution(
                     session, select(func.count(Funnel.id)), "conteggio funnel"
-                ).scalar()
+                ).scalar_one_or_none()
                 or 0
             )
 
@@ -56,7 +180,7 @@ def get_system_stats():
             steps_count = (
                 optimize_query_execution(
                     session, select(func.count(Step.id)), "conteggio step"
-                ).scalar()
+                ).scalar_one_or_none()
                 or 0
             )
 
@@ -64,30 +188,17 @@ def get_system_stats():
             routes_count = (
                 optimize_query_execution(
                     session, select(func.count(Route.id)), "conteggio route"
-                ).scalar()
+                ).scalar_one_or_none()
                 or 0
             )
 
             # Media di step per funnel
             if funnels_count > 0:
                 # Query personalizzata per contare gli step per ogni workflow
-                steps_per_funnel_query = text(
-                    """
-                    SELECT AVG(step_count) as average_steps
-                    FROM (
-                        SELECT f.id as funnel_id, COUNT(DISTINCT r.nextstep_id) as step_count
-                        FROM funnel_manager.funnel f
-                        JOIN funnel_manager.workflow w ON f.workflow_id = w.id
-                        LEFT JOIN funnel_manager.route r ON w.id = r.workflow_id
-                        GROUP BY f.id
-                    ) as step_counts
-                """
-                )
-
                 avg_steps_per_funnel = (
                     optimize_query_execution(
-                        session, steps_per_funnel_query, "media step per funnel"
-                    ).scalar()
+                        session, _Q_AVG_STEPS_PER_FUNNEL, "media step per funnel"
+                    ).scalar_one_or_none()
                     or 0
                 )
             else:
@@ -96,41 +207,18 @@ def get_system_stats():
             # Media di route per funnel
             if funnels_count > 0:
                 # Query personalizzata per contare le route per ogni workflow
-                routes_per_funnel_query = text(
-                    """
-                    SELECT AVG(route_count) as average_routes
-                    FROM (
-                        SELECT f.id as funnel_id, COUNT(r.id) as route_count
-                        FROM funnel_manager.funnel f
-                        JOIN funnel_manager.workflow w ON f.workflow_id = w.id
-                        LEFT JOIN funnel_manager.route r ON w.id = r.workflow_id
-                        GROUP BY f.id
-                    ) as route_counts
-                """
-                )
-
                 avg_routes_per_funnel = (
                     optimize_query_execution(
-                        session, routes_per_funnel_query, "media route per funnel"
-                    ).scalar()
+                        session, _Q_AVG_ROUTES_PER_FUNNEL, "media route per funnel"
+                    ).scalar_one_or_none()
                     or 0
                 )
             else:
                 avg_routes_per_funnel = 0
 
             # Recupero degli ultimi funnel creati
-            latest_funnels_query = text(
-                """
-                SELECT f.id, f.name, p.title_prod as product_name, p.id as product_id
-                FROM funnel_manager.funnel f
-                JOIN product.products p ON f.product_id = p.id
-                ORDER BY f.id DESC
-                LIMIT 5
-            """
-            )
-
             latest_funnels = optimize_query_execution(
-                session, latest_funnels_query, "ultimi funnel creati"
+                session, _Q_LATEST_FUNNELS, "ultimi funnel creati"
             ).fetchall()
 
             # Formatta i risultati
@@ -153,6 +241,7 @@ def get_system_stats():
                 "avg_steps_per_funnel": round(avg_steps_per_funnel, 1),
                 "avg_routes_per_funnel": round(avg_routes_per_funnel, 1),
                 "latest_funnels": latest_funnels_data,
+                "generated_at": time.strftime("%H:%M:%S"),
             }
     except Exception as e:
         logger.error(f"Errore nel recupero delle statistiche del sistema: {e}")
@@ -167,6 +256,7 @@ def get_system_stats():
                 "avg_steps_per_funnel": 0,
                 "avg_routes_per_funnel": 0,
                 "latest_funnels": [],
+                "generated_at": time.strftime("%H:%M:%S"),
             },
         ).get("data")
     finally:
@@ -184,20 +274,9 @@ def get_funnel_stats(funnel_id: Optional[int] = None):
             # Se viene specificato un funnel_id, filtriamo i dati per quel funnel
             if funnel_id:
                 # Query per recuperare informazioni sul funnel selezionato
-                funnel_query = text(
-                    """
-                    SELECT f.id, f.name, p.title_prod as product_name, w.id as workflow_id
-                    FROM funnel_manager.funnel f
-                    JOIN product.products p ON f.product_id = p.id
-                    JOIN funnel_manager.workflow w ON f.workflow_id = w.id
-                    WHERE f.id = :funnel_id
-                """
-                )
-
-                # Esegui la query con i parametri corretti
                 funnel_data = optimize_query_execution(
                     session,
-                    funnel_query.bindparams(funnel_id=int(funnel_id)),
+                    _Q_FUNNEL_DETAILS.bindparams(funnel_id=int(funnel_id)),
                     f"dettagli funnel {funnel_id}"
                 ).fetchone()
 
@@ -210,44 +289,22 @@ def get_funnel_stats(funnel_id: Optional[int] = None):
                 workflow_id = funnel_data.workflow_id
 
                 # Query per recuperare gli step del funnel
-                steps_query = text(
-                    """
-                    SELECT DISTINCT s.id, s.step_url, s.step_code
-                    FROM funnel_manager.step s
-                    JOIN funnel_manager.route r ON s.id = r.nextstep_id OR s.id = r.fromstep_id
-                    WHERE r.workflow_id = :workflow_id
-                """
-                )
-
                 steps = (
                     optimize_query_execution(
-                        session, steps_query, f"step del funnel {funnel_id}"
+                        session,
+                        _Q_FUNNEL_STEPS.bindparams(workflow_id=workflow_id),
+                        f"step del funnel {funnel_id}",
                     )
-                    .bindparams(workflow_id=workflow_id)
                     .fetchall()
                 )
 
                 # Query per recuperare le route del funnel
-                routes_query = text(
-                    """
-                    SELECT
-                        r.id,
-                        fs.step_url as from_step_url,
-                        ns.step_url as to_step_url,
-                        fs.id as from_step_id,
-                        ns.id as to_step_id
-                    FROM funnel_manager.route r
-                    LEFT JOIN funnel_manager.step fs ON r.fromstep_id = fs.id
-                    LEFT JOIN funnel_manager.step ns ON r.nextstep_id = ns.id
-                    WHERE r.workflow_id = :workflow_id
-                """
-                )
-
                 routes = (
                     optimize_query_execution(
-                        session, routes_query, f"route del funnel {funnel_id}"
+                        session,
+                        _Q_FUNNEL_ROUTES.bindparams(workflow_id=workflow_id),
+                        f"route del funnel {funnel_id}",
                     )
-                    .bindparams(workflow_id=workflow_id)
                     .fetchall()
                 )
 
@@ -313,72 +370,21 @@ def get_funnel_stats(funnel_id: Optional[int] = None):
             else:
                 # Se non viene specificato un funnel_id, restituiamo statistiche aggregate
                 # Top 5 funnel per numero di step
-                top_funnels_query = text(
-                    """
-                    SELECT
-                        f.id,
-                        f.name,
-                        p.title_prod as product_name,
-                        COUNT(DISTINCT s.id) as step_count
-                    FROM funnel_manager.funnel f
-                    JOIN product.products p ON f.product_id = p.id
-                    JOIN funnel_manager.workflow w ON f.workflow_id = w.id
-                    JOIN funnel_manager.route r ON w.id = r.workflow_id
-                    JOIN funnel_manager.step s ON r.fromstep_id = s.id OR r.nextstep_id = s.id
-                    GROUP BY f.id, f.name, p.title_prod
-                    ORDER BY step_count DESC
-                    LIMIT 5
-                """
-                )
-
                 top_funnels = optimize_query_execution(
-                    session, top_funnels_query, "top 5 funnel per numero di step"
+                    session, _Q_TOP_FUNNELS, "top 5 funnel per numero di step"
                 ).fetchall()
 
                 # Distribuzioni dei funnel per numero di step
-                funnel_distribution_query = text(
-                    """
-                    SELECT
-                        step_count,
-                        COUNT(*) as funnel_count
-                    FROM (
-                        SELECT
-                            f.id,
-                            COUNT(DISTINCT s.id) as step_count
-                        FROM funnel_manager.funnel f
-                        JOIN funnel_manager.workflow w ON f.workflow_id = w.id
-                        LEFT JOIN funnel_manager.route r ON w.id = r.workflow_id
-                        LEFT JOIN funnel_manager.step s ON r.fromstep_id = s.id OR r.nextstep_id = s.id
-                        GROUP BY f.id
-                    ) as step_counts
-                    GROUP BY step_count
-                    ORDER BY step_count
-                """
-                )
-
                 funnel_distribution = optimize_query_execution(
                     session,
-                    funnel_distribution_query,
+                    _Q_FUNNEL_DISTRIBUTION,
                     "distribuzione funnel per numero di step",
                 ).fetchall()
 
                 # Distribuzioni dei funnel per prodotto
-                product_distribution_query = text(
-                    """
-                    SELECT
-                        p.title_prod,
-                        COUNT(f.id) as funnel_count
-                    FROM funnel_manager.funnel f
-                    JOIN product.products p ON f.product_id = p.id
-                    GROUP BY p.title_prod
-                    ORDER BY funnel_count DESC
-                    LIMIT 10
-                """
-                )
-
                 product_distribution = optimize_query_execution(
                     session,
-                    product_distribution_query,
+                    _Q_PRODUCT_DISTRIBUTION,
                     "distribuzione funnel per prodotto",
                 ).fetchall()
 
@@ -420,6 +426,9 @@ def get_funnel_stats(funnel_id: Optional[int] = None):
 # Recupera le statistiche del sistema
 system_stats = get_system_stats()
 
+# DataFrame degli ultimi funnel, costruito una sola volta per rerun
+_df_latest = pd.DataFrame(system_stats["latest_funnels"])
+
 # Layout della dashboard
 col1, col2, col3, col4 = st.columns(4)
 
@@ -597,14 +606,12 @@ else:
 if system_stats.get("latest_funnels"):
     st.subheader("Ultimi Funnel Creati")
 
-    df_latest = pd.DataFrame(
-        [
-            {"ID": f["id"], "Nome": f["name"], "Prodotto": f["product_name"]}
-            for f in system_stats["latest_funnels"]
-        ]
+    st.dataframe(
+        _df_latest.rename(
+            columns={"id": "ID", "name": "Nome", "product_name": "Prodotto"}
+        )[["ID", "Nome", "Prodotto"]],
+        use_container_width=True,
     )
-
-    st.dataframe(df_latest, use_container_width=True)
 else:
     st.info("Nessun funnel creato finora.")
 
@@ -655,8 +662,9 @@ st.sidebar.selectbox(
     index=4,  # Default a "Tutti i tempi"
 )
 
-# Informazioni sul refresh dei dati
+# Informazioni sul refresh dei dati (l'orario è quello del caricamento in cache,
+# così il nodo non cambia a ogni rerun)
 st.sidebar.caption(
     "I dati vengono aggiornati automaticamente ogni 30 minuti. Ultimo aggiornamento: "
-    + pd.Timestamp.now().strftime("%H:%M:%S")
+    + system_stats.get("generated_at", "N/A")
 )
@@ -2,24 +2,83 @@
 Pagina per l'esportazione e l'importazione delle configurazioni dei funnel.
 """
 
-import json
+import hashlib
+import io
 import logging
+import string
+import unicodedata
 from datetime import datetime
 
-import pandas as pd
+import pyarrow as pa
 import streamlit as st
+from sqlalchemy import func, select
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    ijson = None
 
 from db.funnel_operations import get_funnel_by_product_id
+from db.models import Funnel, Product
+from utils import json_utils
+from utils.db_utils import compiled_cache, engine
 from utils.error_handler import handle_error, log_operation
 from utils.export_import import (
     export_funnel_config,
-    format_export_for_download,
     import_funnel_config,
 )
 
 # Configurazione del logging
 logger = logging.getLogger(__name__)
 
+# Numero massimo di step letti per la tabella di anteprima dell'importazione
+PREVIEW_MAX_STEPS = 500
+
+# Lunghezza massima del JSON completo mostrato nell'anteprima di esportazione
+PREVIEW_MAX_JSON_CHARS = 200_000
+
+# Array del file di export di cui l'anteprima mostra solo il conteggio
+PREVIEW_COUNTED_ARRAYS = {
+    "steps.item": "steps_count",
+    "routes.item": "routes_count",
+    "design.sections.item": "sections_count",
+    "design.components.item": "components_count",
+    "design.structures.item": "structures_count",
+    "design.cms_keys.item": "cms_keys_count",
+}
+
+# Campi scalari del file di export mostrati nell'anteprima
+PREVIEW_FIELDS = {
+    "funnel.name": "funnel_name",
+    "funnel.product.name": "product_name",
+    "funnel.product.code": "product_code",
+    "workflow.description": "workflow_description",
+}
+
+# Elenco dei funnel con il relativo prodotto (LIMIT/OFFSET applicati per pagina)
+AVAILABLE_FUNNELS_QUERY = (
+    select(
+        Funnel.id,
+        Funnel.name,
+        Funnel.workflow_id,
+        Product.id.label("product_id"),
+        func.coalesce(Product.title_prod, "Prodotto senza nome").label("product_name"),
+    )
+    .join(Product, Funnel.product_id == Product.id)
+    .order_by(Funnel.id.desc())
+)
+
+# Tabella di traduzione per i nomi file: i caratteri non ammessi diventano "_"
+_ALLOWED_FILENAME_CHARS = frozenset(string.ascii_letters + string.digits + "._- ")
+_SAFE_FILENAME_TABLE = str.maketrans(
+    {c: "_" for c in map(chr, range(128)) if c not in _ALLOWED_FILENAME_CHARS}
+)
+
+# Errori di parsing da intercettare durante l'anteprima
+PREVIEW_PARSE_ERRORS = (json_utils.JSONDecodeError,) + (
+    (ijson.JSONError,) if ijson is not None else ()
+)
+
 # Configurazione della pagina
 st.set_page_config(
     page_title="Esporta/Importa Funnel",
@@ -35,62 +94,293 @@ st.title("📤 Esporta / Importa Funnel")
 def generate_filename(funnel_name):
     """Genera un nome di file per l'export basato sul nome del funnel."""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    # Rimuovi caratteri non validi per nomi file
-    if funnel_name is None:
-        safe_name = "unknown_funnel"
-    else:
-        safe_name = "".join(
-            c if c.isalnum() or c in "._- " else "_" for c in funnel_name
+    # Rimuovi caratteri non validi per nomi file (gli accenti vengono
+    # ridotti alla lettera base prima della sostituzione)
+    if funnel_name:
+        ascii_name = (
+            unicodedata.normalize("NFKD", funnel_name)
+            .encode("ascii", "ignore")
+            .decode("ascii")
         )
+        safe_name = ascii_name.translate(_SAFE_FILENAME_TABLE)
+    else:
+        safe_name = "unknown_funnel"
     return f"funnel_{safe_name}_{timestamp}.json"
 
 
-# Funzione per caricare tutti i funnel disponibili
-@st.cache_data(ttl=600)
-def load_available_funnels():
-    """Carica tutti i funnel disponibili dal database."""
-    from sqlalchemy import text
+# Funzione per caricare i funnel disponibili (una pagina alla volta)
+@st.cache_data(ttl=600, max_entries=4, show_spinner="Carico funnel...")
+def load_available_funnels(page_size: int = 100, page_offset: int = 0):
+    """
+    Carica una pagina di funnel disponibili dal database.
 
-    from utils.db_utils import close_db_session, get_db_session
+    Args:
+        page_size: Numero massimo di funnel da restituire
+        page_offset: Numero di funnel da saltare (ordinati per ID decrescente)
 
-    session = get_db_session()
+    Returns:
+        List[Row]: Righe con attributi id, name, workflow_id, product_id, product_name
+    """
     try:
-        query = text(
-            """
-            SELECT
-                f.id,
-                f.name,
-                f.workflow_id,
-                p.id as product_id,
-                p.title_prod as product_name
-            FROM funnel_manager.funnel f
-            JOIN product.products p ON f.product_id = p.id
-            ORDER BY f.id DESC
-        """
+        # Query in sola lettura: connessione Core senza sessione ORM, con una
+        # cache dedicata per la compilazione dello statement
+        with engine.connect() as conn:
+            return (
+                conn.execution_options(compiled_cache=compiled_cache)
+                .execute(AVAILABLE_FUNNELS_QUERY.limit(page_size).offset(page_offset))
+                .all()
+            )
+    except Exception as e:
+        return handle_error(
+            e, "Errore nel recupero dei funnel disponibili", fallback_data=[]
+        ).get("data", [])
+
+
+class _ExportFailed(Exception):
+    """Esportazione non riuscita: l'eccezione evita che st.cache_data memorizzi l'errore."""
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_successful_export(funnel_id: int):
+    """Esporta la configurazione di un funnel, memorizzando solo gli esiti positivi."""
+    export_result = export_funnel_config(funnel_id)
+    if export_result.get("error", True):
+        raise _ExportFailed(export_result.get("message", "Errore sconosciuto"))
+    return export_result
+
+
+def cached_export_funnel_config(funnel_id: int):
+    """Esporta la configurazione di un funnel con caching per funnel_id."""
+    try:
+        return _cached_successful_export(funnel_id)
+    except _ExportFailed as e:
+        return {"error": True, "message": str(e)}
+
+
+def prepare_export_download(funnel_id: int):
+    """
+    Esporta il funnel e ne prepara il file JSON, su richiesta dell'utente.
+
+    Il risultato viene conservato in sessione solo come bytes, così il
+    dizionario dell'export non resta in memoria tra un rerun e l'altro.
+
+    Args:
+        funnel_id: ID del funnel da esportare
+
+    Returns:
+        dict: Esito con "error" e "message"; in caso di successo lo stesso esito
+        viene salvato in st.session_state.export_download
+    """
+    export_result = export_funnel_config(funnel_id)
+    if export_result.get("error", True):
+        return export_result
+
+    st.session_state.export_download = {
+        "funnel_id": funnel_id,
+        "data": json_utils.dumps_bytes(export_result["data"], indent=True),
+    }
+    return {"error": False, "message": "Funnel esportato con successo"}
+
+
+@st.cache_data(ttl=600, max_entries=8, show_spinner=False)
+def summarize_import_file(content_hash: str, _raw: bytes):
+    """
+    Estrae le informazioni mostrate nell'anteprima di importazione.
+
+    Con ijson il file viene letto in streaming, quindi la memoria usata non
+    dipende dalla dimensione dei dati di design; senza ijson il file viene
+    decodificato per intero. Il risultato è in cache per hash del contenuto,
+    quindi i rerun della pagina non rileggono lo stesso file.
+
+    Args:
+        content_hash: Hash del contenuto del file, usato come chiave di cache
+        _raw: Contenuto del file caricato (escluso dall'hashing di Streamlit)
+
+    Returns:
+        Dict[str, Any]: Campi principali, conteggi e primi step del funnel
+    """
+    summary = {field: "N/A" for field in PREVIEW_FIELDS.values()}
+    summary.update({count: 0 for count in PREVIEW_COUNTED_ARRAYS.values()})
+    summary["has_design"] = False
+    summary["steps"] = []
+
+    if ijson is None:
+        import_data = json_utils.loads(_raw)
+        funnel_info = import_data.get("funnel", {})
+        product_info = funnel_info.get("product", {})
+        design_data = import_data.get("design", {})
+        steps = import_data.get("steps", [])
+        summary.update(
+            {
+                "funnel_name": funnel_info.get("name", "N/A"),
+                "product_name": product_info.get("name", "N/A"),
+                "product_code": product_info.get("code", "N/A"),
+                "workflow_description": import_data.get("workflow", {}).get(
+                    "description", "N/A"
+                ),
+                "steps_count": len(steps),
+                "routes_count": len(import_data.get("routes", [])),
+                "sections_count": len(design_data.get("sections", [])),
+                "components_count": len(design_data.get("components", [])),
+                "structures_count": len(design_data.get("structures", [])),
+                "cms_keys_count": len(design_data.get("cms_keys", [])),
+                "has_design": bool(design_data),
+                "steps": steps[:PREVIEW_MAX_STEPS],
+            }
         )
+        return summary
+
+    current_step = None
+    for prefix, event, value in ijson.parse(io.BytesIO(_raw)):
+        if event in ("end_map", "end_array"):
+            if prefix == "steps.item" and current_step is not None:
+                summary["steps"].append(current_step)
+                current_step = None
+            continue
+
+        if event == "map_key":
+            if prefix == "design":
+                summary["has_design"] = True
+            continue
+
+        if prefix in PREVIEW_COUNTED_ARRAYS:
+            summary[PREVIEW_COUNTED_ARRAYS[prefix]] += 1
+            if (
+                prefix == "steps.item"
+                and event == "start_map"
+                and len(summary["steps"]) < PREVIEW_MAX_STEPS
+            ):
+                current_step = {}
+        elif prefix in PREVIEW_FIELDS:
+            summary[PREVIEW_FIELDS[prefix]] = value
+        elif current_step is not None and prefix.startswith("steps.item."):
+            key = prefix[len("steps.item.") :]
+            if key in ("id", "step_url", "step_code"):
+                current_step[key] = value
+
+    return summary
+
+
+@st.cache_data(ttl=600, max_entries=8, show_spinner=False)
+def parse_import_file(content_hash: str, _raw: bytes):
+    """
+    Decodifica il file di importazione con caching per hash del contenuto.
+
+    Args:
+        content_hash: Hash del contenuto del file, usato come chiave di cache
+        _raw: Contenuto del file caricato (escluso dall'hashing di Streamlit)
+
+    Returns:
+        Dict[str, Any]: La configurazione del funnel da importare
+    """
+    return json_utils.loads(_raw)
+
+
+def render_funnel_details(funnel):
+    """Mostra i dettagli del funnel selezionato per l'esportazione."""
+    with st.expander("Dettagli del funnel selezionato", expanded=True):
+        st.write(f"**Nome del funnel:** {funnel.name}")
+        st.write(f"**Prodotto:** {funnel.product_name}")
+        st.write(f"**ID funnel:** {funnel.id}")
+        st.write(f"**ID workflow:** {funnel.workflow_id}")
 
-        results = session.execute(query).fetchall()
 
-        funnels = []
-        for row in results:
-            funnels.append(
+@st.fragment
+def render_export_preview(funnel_id: int):
+    """
+    Mostra su richiesta l'anteprima dei dati esportati. Essendo un fragment,
+    i suoi widget rieseguono solo questa parte della pagina.
+    """
+    # Anteprima dei dati, generata solo su richiesta (un checkbox, non un
+    # pulsante, così resta aperta quando si interagisce con il suo contenuto)
+    if st.checkbox("👁️ Anteprima", value=False):
+        with st.spinner("Esportazione del funnel in corso..."):
+            export_result = cached_export_funnel_config(funnel_id)
+
+        if not export_result.get("error", True):
+            export_data = export_result["data"]
+            design_data = export_data.get("design", {})
+            with st.expander("Anteprima dei dati esportati", expanded=True):
+                st.write(f"**Numero di step:** {len(export_data.get('steps', []))}")
+                st.write(
+                    f"**Numero di route:** {len(export_data.get('routes', []))}"
+                )
+                if design_data:
+                    st.write("---")
+                    st.write("**Dati di design inclusi:**")
+                    st.write(f"- Sezioni: {len(design_data.get('sections', []))}")
+                    st.write(
+                        f"- Componenti: {len(design_data.get('components', []))}"
+                    )
+                    st.write(
+                        f"- Strutture: {len(design_data.get('structures', []))}"
+                    )
+                    st.write(f"- Chiavi CMS: {len(design_data.get('cms_keys', []))}")
+
+                # Il JSON completo viene mostrato solo su richiesta e troncato
+                if st.checkbox("Mostra JSON completo", value=False):
+                    st.code(
+                        json_utils.dumps(export_data, indent=True)[
+                            :PREVIEW_MAX_JSON_CHARS
+                        ],
+                        language="json",
+                    )
+        else:
+            st.error(
+                f"Errore durante l'esportazione: {export_result.get('message', 'Errore sconosciuto')}"
+            )
+
+
+def render_import_preview(summary):
+    """Mostra l'anteprima del file di importazione a partire dal riepilogo."""
+    with st.expander("Anteprima dei dati importati", expanded=True):
+        st.write(f"**Funnel:** {summary['funnel_name']}")
+        st.write(
+            f"**Prodotto:** {summary['product_name']} (Codice: {summary['product_code']})"
+        )
+        st.write(f"**Workflow:** {summary['workflow_description']}")
+        st.write(f"**Numero di step:** {summary['steps_count']}")
+        st.write(f"**Numero di route:** {summary['routes_count']}")
+
+        if summary["has_design"]:
+            st.write("---")
+            st.write("**Dati di design inclusi:**")
+            st.write(f"- Sezioni: {summary['sections_count']}")
+            st.write(f"- Componenti: {summary['components_count']}")
+            st.write(f"- Strutture: {summary['structures_count']}")
+            st.write(f"- Chiavi CMS: {summary['cms_keys_count']}")
+
+        # Mostra tabella degli step
+        steps = summary["steps"]
+        if steps:
+            st.subheader("Step inclusi")
+            if summary["steps_count"] > len(steps):
+                st.caption(
+                    f"Mostrati i primi {len(steps)} step su {summary['steps_count']}"
+                )
+            # Tabella Arrow costruita direttamente, senza passare da pandas
+            steps_table = pa.table(
                 {
-                    "id": row.id,
-                    "name": row.name,
-                    "product_id": row.product_id,
-                    "product_name": row.product_name or "Prodotto senza nome",
-                    "workflow_id": row.workflow_id,
+                    "ID": pa.array(
+                        [s.get("id") for s in steps], type=pa.int64()
+                    ),
+                    "URL": pa.array(
+                        [s.get("step_url") for s in steps], type=pa.string()
+                    ),
+                    "Codice": pa.array(
+                        [s.get("step_code", "N/A") for s in steps],
+                        type=pa.string(),
+                    ),
                 }
             )
+            st.dataframe(steps_table, use_container_width=True)
 
-        return funnels
-    except Exception as e:
-        return handle_error(
-            e, "Errore nel recupero dei funnel disponibili", fallback_data=[]
-        ).get("data", [])
-    finally:
-        close_db_session(session)
 
+# Invalidazione della cache dei funnel richiesta da altre pagine
+# (ad esempio dopo la creazione di un funnel in Selezione Prodotti)
+if st.session_state.get("invalidate_funnels_cache"):
+    load_available_funnels.clear()
+    st.session_state.invalidate_funnels_cache = False
 
 # Layout principale
 tab1, tab2 = st.tabs(["Esportazione", "Importazione"])
@@ -104,30 +394,39 @@ with tab1:
     """
     )
 
+    # Controlli di paginazione per l'elenco dei funnel
+    page_col1, page_col2 = st.columns(2)
+    with page_col1:
+        page_size = st.number_input(
+            "Funnel per pagina", min_value=10, max_value=500, value=100, step=10
+        )
+    with page_col2:
+        page_number = st.number_input("Pagina", min_value=1, value=1, step=1)
+
     # Carica i funnel disponibili
-    funnels = load_available_funnels()
+    funnels = load_available_funnels(
+        int(page_size), (int(page_number) - 1) * int(page_size)
+    )
 
     if not funnels:
         st.warning("Non ci sono funnel disponibili per l'esportazione.")
     else:
-        # Crea un selectbox per selezionare il funnel
-        funnel_options = [
-            f"{f['name']} - {f['product_name']} (ID: {f['id']})" for f in funnels
-        ]
-        selected_funnel_idx = st.selectbox(
-            "Seleziona un funnel da esportare:",
-            range(len(funnels)),
-            format_func=lambda i: funnel_options[i],
-        )
-
-        selected_funnel = funnels[selected_funnel_idx]
+        # Crea un selectbox per selezionare il funnel: l'etichetta viene
+        # calcolata solo al momento della visualizzazione
+        select_col, refresh_col = st.columns([5, 1])
+        with select_col:
+            selected_funnel = st.selectbox(
+                "Seleziona un funnel da esportare:",
+                funnels,
+                format_func=lambda f: f"{f.name} - {f.product_name} (ID: {f.id})",
+            )
+        with refresh_col:
+            if st.button("🔄 Ricarica lista"):
+                load_available_funnels.clear()
+                st.rerun()
 
         # Mostra dettagli del funnel selezionato
-        with st.expander("Dettagli del funnel selezionato", expanded=True):
-            st.write(f"**Nome del funnel:** {selected_funnel['name']}")
-            st.write(f"**Prodotto:** {selected_funnel['product_name']}")
-            st.write(f"**ID funnel:** {selected_funnel['id']}")
-            st.write(f"**ID workflow:** {selected_funnel['workflow_id']}")
+        render_funnel_details(selected_funnel)
 
         # Opzioni di esportazione
         st.subheader("Opzioni di esportazione")
@@ -137,39 +436,33 @@ with tab1:
             help="Se attivato, include dati sensibili come ID broker e configurazioni dettagliate",
         )
 
-        # Pulsante di esportazione
-        if st.button("📤 Esporta Funnel"):
+        # L'export viene costruito solo su richiesta, non a ogni rerun
+        if st.button("📤 Prepara export"):
             with st.spinner("Esportazione del funnel in corso..."):
-                # Esporta la configurazione del funnel
-                export_result = export_funnel_config(selected_funnel["id"])
-
-                if not export_result.get("error", True):
-                    # Formatta il JSON per il download
-                    export_json = format_export_for_download(export_result)
-
-                    # Genera un nome file significativo
-                    funnel_name = selected_funnel.get("name")
-                    filename = generate_filename(funnel_name)
+                export_outcome = prepare_export_download(selected_funnel.id)
+            if export_outcome.get("error", True):
+                st.error(
+                    f"Errore durante l'esportazione: {export_outcome.get('message', 'Errore sconosciuto')}"
+                )
 
-                    # Aggiungi il pulsante di download
-                    st.success(
-                        f"Funnel esportato con successo! Clicca il pulsante qui sotto per scaricarlo."
-                    )
-                    st.download_button(
-                        label="📥 Scarica configurazione funnel",
-                        data=export_json,
-                        file_name=filename,
-                        mime="application/json",
-                        key="download-funnel-json",
-                    )
+        # Il pulsante di download compare solo dopo un export riuscito del funnel selezionato
+        export_download = st.session_state.get("export_download")
+        if export_download and export_download["funnel_id"] == selected_funnel.id:
+            st.success(
+                "Funnel esportato con successo! Clicca il pulsante qui sotto per scaricarlo."
+            )
+            st.download_button(
+                label="📥 Scarica configurazione funnel",
+                data=export_download["data"],
+                file_name=generate_filename(selected_funnel.name),
+                mime="application/json",
+                key="download-funnel-json",
+            )
+        elif export_download:
+            # Cambiato funnel: il file preparato non serve più
+            del st.session_state.export_download
 
-                    # Anteprima dei dati
-                    with st.expander("Anteprima dei dati esportati"):
-                        st.json(export_result["data"])
-                else:
-                    st.error(
-                        f"Errore durante l'esportazione: {export_result.get('message', 'Errore sconosciuto')}"
-                    )
+        render_export_preview(selected_funnel.id)
 
 with tab2:
     st.subheader("Importa Configurazione Funnel")
@@ -187,56 +480,17 @@ with tab2:
 
     if uploaded_file is not None:
         try:
-            # Leggi il contenuto del file
-            import_data = json.load(uploaded_file)
+            # Il file viene identificato dall'hash del contenuto, così anteprima e
+            # parsing vengono eseguiti una sola volta per ogni file caricato
+            raw = uploaded_file.getvalue()
+            content_hash = hashlib.blake2b(raw, digest_size=16).hexdigest()
 
-            # Mostra anteprima dei dati importati
-            with st.expander("Anteprima dei dati importati", expanded=True):
-                # Estrai informazioni principali
-                funnel_info = import_data.get("funnel", {})
-                product_info = funnel_info.get("product", {})
-                workflow_info = import_data.get("workflow", {})
-                steps = import_data.get("steps", [])
-                routes = import_data.get("routes", [])
-                design_data = import_data.get("design", {})
-
-                # Verifica se ci sono dati di design
-                has_design = bool(design_data)
-                sections = design_data.get("sections", [])
-                components = design_data.get("components", [])
-                structures = design_data.get("structures", [])
-                cms_keys = design_data.get("cms_keys", [])
-
-                st.write(f"**Funnel:** {funnel_info.get('name', 'N/A')}")
-                st.write(
-                    f"**Prodotto:** {product_info.get('name', 'N/A')} (Codice: {product_info.get('code', 'N/A')})"
-                )
-                st.write(f"**Workflow:** {workflow_info.get('description', 'N/A')}")
-                st.write(f"**Numero di step:** {len(steps)}")
-                st.write(f"**Numero di route:** {len(routes)}")
+            # Legge in streaming solo i dati necessari per l'anteprima
+            summary = summarize_import_file(content_hash, raw)
+            has_design = summary["has_design"]
 
-                if has_design:
-                    st.write("---")
-                    st.write("**Dati di design inclusi:**")
-                    st.write(f"- Sezioni: {len(sections)}")
-                    st.write(f"- Componenti: {len(components)}")
-                    st.write(f"- Strutture: {len(structures)}")
-                    st.write(f"- Chiavi CMS: {len(cms_keys)}")
-
-                # Mostra tabella degli step
-                if steps:
-                    st.subheader("Step inclusi")
-                    steps_df = pd.DataFrame(
-                        [
-                            {
-                                "ID": s.get("id"),
-                                "URL": s.get("step_url"),
-                                "Codice": s.get("step_code", "N/A"),
-                            }
-                            for s in steps
-                        ]
-                    )
-                    st.dataframe(steps_df, use_container_width=True)
+            # Mostra anteprima dei dati importati
+            render_import_preview(summary)
 
             # Opzioni di importazione
             st.subheader("Opzioni di importazione")
@@ -257,10 +511,18 @@ with tab2:
             # Pulsante di importazione
             if st.button("📥 Importa Funnel"):
                 with st.spinner("Importazione del funnel in corso..."):
+                    # Il documento completo viene decodificato solo ora
+                    import_data = parse_import_file(content_hash, raw)
+
                     # Importa la configurazione del funnel
                     import_result = import_funnel_config(import_data, update_existing)
 
                     if not import_result.get("error", True):
+                        # Il nuovo funnel deve comparire subito negli elenchi
+                        load_available_funnels.clear()
+                        _cached_successful_export.clear()
+                        st.session_state.invalidate_product_cache = True
+
                         st.success(
                             f"{import_result.get('message', 'Importazione completata con successo')}"
                         )
@@ -293,7 +555,7 @@ with tab2:
                             f"Errore durante l'importazione: {import_result.get('message', 'Errore sconosciuto')}"
                         )
 
-        except json.JSONDecodeError:
+        except PREVIEW_PARSE_ERRORS:
             st.error(
                 "Il file caricato non è un JSON valido. Verifica il formato del file."
             )
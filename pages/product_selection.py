@@ -1,15 +1,18 @@
-import pandas as pd
 import streamlit as st
 
 from db.funnel_operations import (
     create_product_funnel,
     get_funnel_by_product_id,
+    get_funnels_by_product_id,
     get_products,
 )
 
 # Configurazione della pagina
 st.title("Selezione Prodotto")
 
+# Lunghezza minima del termine di ricerca per filtrare i prodotti
+MIN_SEARCH_TERM_LENGTH = 2
+
 # Inizializzazione delle variabili di sessione
 if "funnel_id" not in st.session_state:
     st.session_state.funnel_id = None
@@ -28,22 +31,73 @@ def cached_get_products():
     return get_products()
 
 
+@st.cache_data(ttl=300)
+def cached_get_products_by_id():
+    """Restituisce i prodotti indicizzati per ID, per lookup in O(1)."""
+    return {p["id"]: p for p in cached_get_products()}
+
+
+@st.cache_data(ttl=300)
+def cached_search_index():
+    """
+    Restituisce coppie (prodotto, testo di ricerca) con codice, titolo e
+    descrizione già convertiti in minuscolo e concatenati.
+    """
+    return [
+        (
+            p,
+            f"{(p['code'] or '').lower()}\0"
+            f"{(p['title'] or '').lower()}\0"
+            f"{(p['description'] or '').lower()}",
+        )
+        for p in cached_get_products()
+    ]
+
+
+@st.cache_data(ttl=300)
+def cached_funnels_by_product_id():
+    """Recupera con caching i funnel esistenti indicizzati per ID prodotto."""
+    return get_funnels_by_product_id()
+
+
+def clear_product_caches():
+    """Svuota la cache dei prodotti e degli indici derivati."""
+    cached_get_products.clear()
+    cached_get_products_by_id.clear()
+    cached_search_index.clear()
+    cached_funnels_by_product_id.clear()
+
+
+def format_product_option(product_id):
+    """Restituisce l'etichetta del selectbox per un ID prodotto."""
+    if product_id is None:
+        return "Seleziona un prodotto..."
+    product = cached_get_products_by_id().get(product_id)
+    if product is None:
+        return "Sconosciuto"
+    return f"{product['title'] or 'N/A'} ({product['code']})"
+
+
 def update_product_selection():
     """Callback: Aggiorna lo stato del prodotto selezionato."""
     product_id = st.session_state.product_selector
     if product_id:
         # Trova il nome del prodotto selezionato
-        for product in cached_get_products():
-            if product["id"] == product_id:
-                st.session_state.selected_product_name = (
-                    product["title"] or product["code"]
-                )
-                break
+        product = cached_get_products_by_id().get(product_id)
+        if product:
+            st.session_state.selected_product_name = (
+                product["title"] or product["code"]
+            )
 
         st.session_state.selected_product_id = product_id
 
-        # Verifica se esiste già un funnel per questo prodotto
-        funnel = get_funnel_by_product_id(product_id)
+        # Verifica se esiste già un funnel per questo prodotto, usando la mappa
+        # precaricata e interrogando il DB solo per i funnel non ancora in cache
+        funnel = cached_funnels_by_product_id().get(product_id)
+        if funnel is None:
+            funnel = get_funnel_by_product_id(product_id)
+            if funnel:
+                cached_funnels_by_product_id.clear()
         if funnel:
             st.session_state.funnel_id = funnel["id"]
             st.session_state.workflow_id = funnel["workflow_id"]
@@ -69,6 +123,9 @@ def create_funnel():
             if not result["error"]:
                 st.session_state.funnel_id = result["funnel"]["id"]
                 st.session_state.workflow_id = result["funnel"]["workflow_id"]
+                # Aggiorna l'elenco dei funnel nella pagina di esportazione
+                st.session_state.invalidate_funnels_cache = True
+                st.session_state.invalidate_product_cache = True
                 # Imposta la notifica
                 st.session_state.notification = {
                     "type": "success",
@@ -110,11 +167,12 @@ if (
     "invalidate_product_cache" in st.session_state
     and st.session_state.invalidate_product_cache
 ):
-    cached_get_products.clear()
+    clear_product_caches()
     st.session_state.invalidate_product_cache = False
 
 # Recupera l'elenco dei prodotti utilizzando la funzione cached
 products = cached_get_products()
+products_by_id = cached_get_products_by_id()
 
 if products:
     # Container con bordo per la selezione del prodotto
@@ -124,16 +182,13 @@ if products:
             "🔍 Cerca prodotto (per codice o titolo):", key="product_search"
         )
 
-        if search_term:
+        # Un solo carattere corrisponde a quasi tutti i prodotti ed è di solito
+        # una digitazione in corso: si filtra da due caratteri in su
+        if len(search_term) >= MIN_SEARCH_TERM_LENGTH:
             # Filtra i prodotti in base al termine di ricerca
+            term = search_term.lower()
             filtered_products = [
-                p
-                for p in products
-                if (p["code"] and search_term.lower() in p["code"].lower())
-                or (p["title"] and search_term.lower() in p["title"].lower())
-                or (
-                    p["description"] and search_term.lower() in p["description"].lower()
-                )
+                p for p, search_text in cached_search_index() if term in search_text
             ]
         else:
             filtered_products = products
@@ -141,19 +196,12 @@ if products:
         # Mostra il numero di prodotti trovati
         st.caption(f"{len(filtered_products)} prodotti trovati")
 
-        # Crea un dizionario per il formato di visualizzazione nel selectbox
-        product_options = {
-            p["id"]: f"{p['title'] or 'N/A'} ({p['code']})" for p in filtered_products
-        }
-
-        # Aggiungi un'opzione vuota all'inizio
-        product_options = {None: "Seleziona un prodotto..."} | product_options
-
-        # Selectbox per la selezione del prodotto
+        # Selectbox per la selezione del prodotto: le opzioni sono solo ID,
+        # le etichette vengono calcolate da format_product_option
         st.selectbox(
             "Seleziona un prodotto:",
-            options=list(product_options.keys()),
-            format_func=lambda x: product_options.get(x, "Sconosciuto"),
+            options=[None, *[p["id"] for p in filtered_products]],
+            format_func=format_product_option,
             key="product_selector",
             on_change=update_product_selection,
         )
@@ -161,13 +209,8 @@ if products:
     # Mostra i dettagli del prodotto selezionato
     if st.session_state.selected_product_id:
         with st.container(border=True):
-            selected_product = next(
-                (
-                    p
-                    for p in products
-                    if p["id"] == st.session_state.selected_product_id
-                ),
-                None,
+            selected_product = products_by_id.get(
+                st.session_state.selected_product_id
             )
             if selected_product:
                 st.subheader("Prodotto selezionato:")
@@ -207,7 +250,7 @@ if products:
             )
 else:
     st.error("Impossibile recuperare l'elenco dei prodotti dal database.")
-    if st.button("Riprova", on_click=lambda: cached_get_products.clear()):
+    if st.button("Riprova", on_click=clear_product_caches):
         st.rerun()
 
 # Link di navigazione a fine pagina
@@ -1,13 +1,30 @@
-import json
+from operator import itemgetter
 
+import pandas as pd
 import streamlit as st
 
-from db.route_operations import create_route, delete_route, get_routes_for_workflow
+from db.route_operations import create_route, delete_routes, get_routes_for_workflow
 from db.step_operations import get_steps
+from utils import json_utils
 
 # Configurazione della pagina
 st.title("Gestione Route del Funnel")
 
+# Template Markdown delle righe della sezione "Route Esistenti"
+ROUTE_ROW_TEMPLATE = "**Da:** {from_url}  ➡️  **A:** {to_url}"
+ROUTE_CODES_TEMPLATE = "\n\n`Codici: {from_code} / {to_code}`"
+
+# Numero di route mostrate per pagina nella sezione "Route Esistenti"
+ROUTES_PAGE_SIZE = 25
+
+# Funzioni di visualizzazione per tipo di notifica
+NOTIFICATION_RENDERERS = {
+    "success": st.success,
+    "info": st.info,
+    "warning": st.warning,
+    "error": st.error,
+}
+
 
 # Utilizzo di st.cache_data per le operazioni di database
 @st.cache_data(ttl=300)
@@ -17,6 +34,19 @@ def cached_get_steps():
 
 
 @st.cache_data(ttl=300)
+def cached_step_options():
+    """
+    Restituisce le opzioni dei selectbox degli step: la lista di ID (con None
+    in testa) e le etichette formattate per ID.
+    """
+    step_labels = {
+        s["id"]: f"{s['step_url']} ({s['step_code'] or 'No code'})"
+        for s in cached_get_steps()
+    }
+    return [None, *step_labels], step_labels
+
+
+@st.cache_data(ttl=3600)
 def cached_get_routes_for_workflow(workflow_id):
     """Recupera le route per un workflow specifico con caching."""
     if workflow_id:
@@ -24,14 +54,131 @@ def cached_get_routes_for_workflow(workflow_id):
     return []
 
 
+@st.cache_data(ttl=3600)
+def cached_group_routes_by_source(workflow_id):
+    """
+    Raggruppa le route di un workflow per step di partenza (None per
+    l'ingresso), mantenendo l'ordine di prima apparizione dei gruppi.
+    """
+    workflow_routes = cached_get_routes_for_workflow(workflow_id)
+    if not workflow_routes:
+        return {}
+
+    routes_df = pd.DataFrame(workflow_routes)
+    source_ids = (
+        routes_df["from_step"].map(lambda s: s["id"] if s else None).astype("Int64")
+    )
+    return {
+        None if pd.isna(source_id) else int(source_id): group.to_dict("records")
+        for source_id, group in routes_df.groupby(source_ids, sort=False, dropna=False)
+    }
+
+
+@st.cache_data(ttl=3600)
+def build_routes_render_model(workflow_id):
+    """
+    Prepara i testi già formattati per la sezione "Route Esistenti".
+
+    Args:
+        workflow_id: ID del workflow
+
+    Returns:
+        list: Coppie (titolo del gruppo, righe), dove ogni riga contiene il
+            Markdown della route già formattato
+    """
+    render_model = []
+    for source_id, routes in cached_group_routes_by_source(workflow_id).items():
+        group_title = (
+            "Dall'ingresso del funnel:"
+            if source_id is None
+            else f"Da step {source_id} ({routes[0]['from_step']['url']}):"
+        )
+        rows = []
+        for route in routes:
+            from_step = route["from_step"] or {}
+            next_step = route["next_step"]
+            from_url = from_step.get("url", "Ingresso")
+            markdown = ROUTE_ROW_TEMPLATE.format(
+                from_url=from_url, to_url=next_step["url"]
+            )
+            if from_step.get("code") or next_step.get("code"):
+                markdown += ROUTE_CODES_TEMPLATE.format(
+                    from_code=from_step.get("code") or "-",
+                    to_code=next_step.get("code") or "-",
+                )
+            rows.append(
+                {
+                    "id": route["id"],
+                    "from_url": from_url,
+                    "to_url": next_step["url"],
+                    "markdown": markdown,
+                    "route_config": route["route_config"],
+                }
+            )
+        render_model.append((group_title, rows))
+    return render_model
+
+
+@st.cache_data(ttl=3600)
+def build_routes_page(workflow_id, page):
+    """
+    Restituisce la pagina richiesta del render model, con al massimo
+    ROUTES_PAGE_SIZE route e i gruppi ridotti alle sole righe della pagina.
+    """
+    start = page * ROUTES_PAGE_SIZE
+    end = start + ROUTES_PAGE_SIZE
+
+    page_groups = []
+    offset = 0
+    for group_title, rows in build_routes_render_model(workflow_id):
+        group_rows = rows[max(start - offset, 0) : max(end - offset, 0)]
+        if group_rows:
+            page_groups.append((group_title, group_rows))
+        offset += len(rows)
+        if offset >= end:
+            break
+    return page_groups
+
+
+@st.cache_data(ttl=3600)
+def cached_funnel_steps(workflow_id):
+    """
+    Restituisce gli step distinti collegati dalle route del workflow come
+    coppie (id, url) ordinate per ID (gli ID None per primi).
+    """
+    steps_in_funnel = set()
+    for route in cached_get_routes_for_workflow(workflow_id) or []:
+        if route["from_step"]:
+            steps_in_funnel.add((route["from_step"]["id"], route["from_step"]["url"]))
+        steps_in_funnel.add((route["next_step"]["id"], route["next_step"]["url"]))
+
+    # Gli ID None vanno in testa; il resto è ordinato con itemgetter (in C)
+    none_steps = [step for step in steps_in_funnel if step[0] is None]
+    other_steps = sorted(
+        (step for step in steps_in_funnel if step[0] is not None), key=itemgetter(0)
+    )
+    return none_steps + other_steps
+
+
+def clear_route_caches():
+    """Svuota le cache delle route dopo una modifica al database."""
+    cached_get_routes_for_workflow.clear()
+    cached_group_routes_by_source.clear()
+    build_routes_render_model.clear()
+    build_routes_page.clear()
+    cached_funnel_steps.clear()
+    st.session_state.routes_version = st.session_state.get("routes_version", 0) + 1
+
+
 def validate_json_input(json_string):
     """Valida un input JSON e restituisce un dizionario o None."""
-    if not json_string:
+    # Input vuoto o di soli spazi: nessuna configurazione, niente parsing
+    if not json_string or json_string.isspace():
         return None
 
     try:
-        return json.loads(json_string)
-    except json.JSONDecodeError:
+        return json_utils.loads(json_string.encode("utf-8"))
+    except json_utils.JSONDecodeError:
         return "error"
 
 
@@ -68,8 +215,8 @@ def handle_route_creation():
             "type": "success",
             "message": result["message"],
         }
-        # Invalida la cache delle route
-        st.session_state.invalidate_route_cache = True
+        # Invalida subito la cache delle route
+        clear_route_caches()
         # Imposta un flag per resettare il form al prossimo caricamento
         st.session_state.reset_route_form = True
         # Ricarica la pagina
@@ -79,109 +226,59 @@ def handle_route_creation():
         st.session_state.notification = {"type": "error", "message": result["message"]}
 
 
-def delete_route_callback(route_id):
-    """Callback per eliminare una route."""
-    if route_id:
-        result = delete_route(route_id)
-
-        if not result["error"]:
-            # Imposta la notifica di successo
-            st.session_state.notification = {
-                "type": "success",
-                "message": result["message"],
-            }
-            # Invalida la cache delle route
-            st.session_state.invalidate_route_cache = True
-            # Ricarica la pagina
-            st.rerun()
-        else:
-            # Imposta la notifica di errore
-            st.session_state.notification = {
-                "type": "error",
-                "message": result["message"],
-            }
-
-
-# Mostra le notifiche
-if "notification" in st.session_state and st.session_state.notification:
-    notification_type = st.session_state.notification["type"]
-    message = st.session_state.notification["message"]
-
-    if notification_type == "success":
-        st.success(message)
-    elif notification_type == "info":
-        st.info(message)
-    elif notification_type == "warning":
-        st.warning(message)
-    elif notification_type == "error":
-        st.error(message)
-
-    # Reset della notifica dopo la visualizzazione
-    st.session_state.notification = None
-
-# Verifica se è stato selezionato un prodotto e un funnel
-if (
-    "selected_product_id" not in st.session_state
-    or "funnel_id" not in st.session_state
-    or not st.session_state.selected_product_id
-    or not st.session_state.funnel_id
-):
-    st.warning(
-        "Seleziona prima un prodotto e crea un funnel nella pagina 'Selezione Prodotto'."
-    )
-
-    # Pulsante per tornare alla selezione del prodotto
-    st.page_link(
-        "pages/product_selection.py", label="Vai a Selezione Prodotti", icon="🛒"
-    )
-    st.stop()
+def change_route_page(delta):
+    """Callback per spostarsi tra le pagine della sezione "Route Esistenti"."""
+    st.session_state.route_page = max(st.session_state.get("route_page", 0) + delta, 0)
 
-st.subheader(f"Funnel per: {st.session_state.selected_product_name}")
 
-# Uso di expander per mostrare informazioni tecniche quando necessario
-with st.expander("Dettagli tecnici"):
-    st.write(f"Funnel ID: {st.session_state.funnel_id}")
-    st.write(f"Workflow ID: {st.session_state.workflow_id}")
+def delete_routes_callback(route_ids):
+    """Elimina le route selezionate nel form di eliminazione multipla."""
+    if not route_ids:
+        return
 
-# Invalidazione condizionale della cache
-if (
-    "invalidate_route_cache" in st.session_state
-    and st.session_state.invalidate_route_cache
-):
-    cached_get_routes_for_workflow.clear()
-    st.session_state.invalidate_route_cache = False
+    result = delete_routes(route_ids)
 
-# Gestione del reset del form
-if "reset_route_form" in st.session_state and st.session_state.reset_route_form:
-    # Resetta i campi del form
-    if "route_config" in st.session_state:
-        del st.session_state["route_config"]
-    st.session_state.reset_route_form = False
+    if not result["error"]:
+        # Imposta la notifica di successo
+        st.session_state.notification = {
+            "type": "success",
+            "message": result["message"],
+        }
+        # Invalida subito la cache delle route
+        clear_route_caches()
+        # Ricarica la pagina
+        st.rerun()
+    else:
+        # Imposta la notifica di errore
+        st.session_state.notification = {
+            "type": "error",
+            "message": result["message"],
+        }
 
-# Layout a colonne per una migliore organizzazione
-col1, col2 = st.columns([2, 3])
 
-with col1:
-    # Form per la creazione di una nuova route
+@st.fragment
+def render_route_form():
+    """
+    Mostra il form di creazione delle route. Essendo un fragment, le
+    interazioni con il form non rieseguono il resto della pagina.
+    """
     with st.container(border=True):
         st.subheader("Crea Nuovo Collegamento (Route)")
 
-        # Recupera tutti gli step disponibili
-        all_steps = cached_get_steps()
+        # Gli step vengono recuperati solo quando il form è visibile
+        if not st.toggle("Mostra form", value=True, key="show_create_form"):
+            return
 
-        if all_steps:
-            # Crea un dizionario per il formato di visualizzazione nel selectbox
-            step_options = {
-                s["id"]: f"{s['step_url']} ({s['step_code'] or 'No code'})"
-                for s in all_steps
-            }
+        # Opzioni ed etichette dei selectbox, calcolate una volta per cache
+        step_option_ids, step_options = cached_step_options()
 
+        if step_options:
             # Uso st.form per raggruppare i controlli e ridurre i reruns
             with st.form(key="create_route_form"):
                 # Step di partenza (può essere None per lo step iniziale)
                 st.selectbox(
                     "Da Step:",
-                    options=[None] + list(step_options.keys()),
+                    options=step_option_ids,
                     format_func=lambda x: (
                         "Step iniziale (ingresso)"
                         if x is None
@@ -194,7 +291,7 @@ with col1:
                 # Step di destinazione (obbligatorio)
                 st.selectbox(
                     "A Step:",
-                    options=[None] + list(step_options.keys()),
+                    options=step_option_ids,
                     format_func=lambda x: (
                         "Seleziona uno step..."
                         if x is None
@@ -231,92 +328,61 @@ with col1:
                 "pages/steps_manager.py", label="Vai a Gestione Step", icon="🔄"
             )
 
-    # Guida rapida per la creazione di route
-    with st.expander("📌 Guida rapida"):
-        st.markdown(
-            """
-        ### Come creare un collegamento (route):
-
-        1. **Da Step**: Seleziona lo step di partenza (o "Step iniziale" per l'ingresso nel funnel)
-        2. **A Step**: Seleziona lo step di destinazione (obbligatorio)
-        3. **Configurazione**: Aggiungi una configurazione JSON opzionale per la route
-
-        **Le route definiscono il percorso che l'utente può seguire nel funnel.**
-
-        Per creare un funnel completo:
-        - Inizia con una route dallo step iniziale al primo step
-        - Collega tutti gli step in sequenza
-        - Se necessario, crea percorsi alternativi (branch)
-        """
-        )
 
-with col2:
+@st.fragment
+def render_existing_routes(workflow_id, routes_version):
+    """
+    Mostra le route esistenti del workflow e la panoramica del funnel.
+    Essendo un fragment, le interazioni con il form di eliminazione rieseguono
+    solo questa sezione (l'eliminazione riesegue comunque l'intera pagina).
+    """
     st.subheader("Route Esistenti")
 
     # Recupera le route associate al workflow corrente
-    workflow_routes = cached_get_routes_for_workflow(st.session_state.workflow_id)
+    workflow_routes = cached_get_routes_for_workflow(workflow_id)
 
     if workflow_routes:
-        # Raggruppa le route per step di partenza per una visualizzazione più organizzata
-        routes_by_source = {}
-        for route in workflow_routes:
-            source_id = route["from_step"]["id"] if route["from_step"] else None
-            if source_id not in routes_by_source:
-                routes_by_source[source_id] = []
-            routes_by_source[source_id].append(route)
+        # Paginazione: ogni rerun elabora al massimo ROUTES_PAGE_SIZE route
+        page_count = -(-len(workflow_routes) // ROUTES_PAGE_SIZE)
+        page = min(st.session_state.get("route_page", 0), page_count - 1)
+        st.session_state.route_page = page
+
+        # Testi delle route della pagina, raggruppati per step di partenza
+        routes_page = build_routes_page(workflow_id, page)
 
         # Visualizza il numero totale di route
         st.caption(f"Totale: {len(workflow_routes)} collegamenti")
 
-        # Visualizza le route raggruppate per step di partenza
-        for source_id, routes in routes_by_source.items():
-            # Determina il titolo del gruppo
-            group_title = (
-                "Dall'ingresso del funnel:"
-                if source_id is None
-                else f"Da step {source_id} ({routes[0]['from_step']['url']}):"
-            )
+        if page_count > 1:
+            prev_col, info_col, next_col = st.columns([1, 2, 1])
+            with prev_col:
+                st.button(
+                    "⬅️ Precedenti",
+                    on_click=change_route_page,
+                    args=(-1,),
+                    disabled=page == 0,
+                )
+            with info_col:
+                st.caption(f"Pagina {page + 1} di {page_count}")
+            with next_col:
+                st.button(
+                    "Successive ➡️",
+                    on_click=change_route_page,
+                    args=(1,),
+                    disabled=page >= page_count - 1,
+                )
 
+        # Visualizza le route raggruppate per step di partenza
+        for group_title, routes in routes_page:
             # Crea un container per il gruppo
             with st.container(border=True):
                 st.markdown(f"**{group_title}**")
 
                 # Visualizza ogni route nel gruppo
-                for route in routes:
-                    cols = st.columns([3, 1, 3, 1])
-
-                    # Da step
-                    with cols[0]:
-                        from_label = (
-                            "Ingresso"
-                            if route["from_step"] is None
-                            else f"{route['from_step']['url']}"
-                        )
-                        st.markdown(f"**Da:** {from_label}")
-                        if route["from_step"] and route["from_step"].get("code"):
-                            st.caption(f"Codice: {route['from_step']['code']}")
-
-                    # Freccia
-                    with cols[1]:
-                        st.markdown("➡️")
-
-                    # A step
-                    with cols[2]:
-                        st.markdown(f"**A:** {route['next_step']['url']}")
-                        if route["next_step"].get("code"):
-                            st.caption(f"Codice: {route['next_step']['code']}")
-
-                    # Azioni
-                    with cols[3]:
-                        # Uso di una chiave univoca per ogni bottone
-                        unique_key = f"delete_route_{route['id']}"
-                        st.button(
-                            "❌",
-                            key=unique_key,
-                            help="Elimina questa route",
-                            on_click=delete_route_callback,
-                            args=(route["id"],),
-                        )
+                last_index = len(routes) - 1
+                for i, route in enumerate(routes):
+                    # Un unico blocco Markdown per riga
+                    st.markdown(route["markdown"])
 
                     # Config (se presente)
                     if route["route_config"]:
@@ -324,37 +390,57 @@ with col2:
                             st.json(route["route_config"])
 
                     # Aggiungi un separatore tra le route
-                    if route != routes[-1]:
+                    if i < last_index:
                         st.divider()
 
+        # Un unico form per l'eliminazione: un solo invio al posto di un
+        # pulsante per ogni route
+        with st.form("delete_routes_form"):
+            st.markdown("**Elimina route**")
+            edited_routes = st.data_editor(
+                pd.DataFrame(
+                    [
+                        {
+                            "ID": route["id"],
+                            "Da": route["from_url"],
+                            "A": route["to_url"],
+                            "Elimina": False,
+                        }
+                        for _, routes in routes_page
+                        for route in routes
+                    ]
+                ),
+                column_config={
+                    "Elimina": st.column_config.CheckboxColumn(
+                        "Elimina", help="Seleziona le route da eliminare"
+                    )
+                },
+                disabled=["ID", "Da", "A"],
+                hide_index=True,
+                use_container_width=True,
+                key=f"delete_routes_editor_{routes_version}_{page}",
+            )
+            if st.form_submit_button("❌ Elimina selezionate"):
+                delete_routes_callback(
+                    edited_routes.loc[edited_routes["Elimina"], "ID"].tolist()
+                )
+
         # Visualizzazione grafica del funnel
         with st.expander("🔄 Visualizzazione del funnel", expanded=True):
             st.caption(
                 "Questa è una rappresentazione semplificata del flusso del funnel."
             )
 
-            # Implementa una visualizzazione semplice
-            steps_in_funnel = set()
-            for route in workflow_routes:
-                if route["from_step"]:
-                    steps_in_funnel.add(
-                        (route["from_step"]["id"], route["from_step"]["url"])
-                    )
-                steps_in_funnel.add(
-                    (route["next_step"]["id"], route["next_step"]["url"])
-                )
+            # Step distinti del funnel, già ordinati per ID
+            sorted_steps = cached_funnel_steps(workflow_id)
 
             # Crea un grafico semplice usando ASCII art o Markdown
             st.write(
-                f"Il funnel contiene {len(steps_in_funnel)} step connessi da {len(workflow_routes)} route."
+                f"Il funnel contiene {len(sorted_steps)} step connessi da {len(workflow_routes)} route."
             )
 
             # Mostra un elenco numerico di tutti gli step nel funnel
             st.markdown("**Step nel funnel:**")
-            # Ordina gli step, gestendo i valori None
-            sorted_steps = sorted(
-                steps_in_funnel, key=lambda x: x[0] if x[0] is not None else -1
-            )
             for i, (step_id, step_url) in enumerate(sorted_steps):
                 st.markdown(f"{i+1}. Step {step_id}: `{step_url}`")
 
@@ -377,6 +463,77 @@ with col2:
             """
             )
 
+
+# Mostra le notifiche (pop la rimuove anche dalla sessione)
+notification = st.session_state.pop("notification", None)
+if notification:
+    NOTIFICATION_RENDERERS.get(notification["type"], st.info)(notification["message"])
+
+# Verifica se è stato selezionato un prodotto e un funnel
+if (
+    "selected_product_id" not in st.session_state
+    or "funnel_id" not in st.session_state
+    or not st.session_state.selected_product_id
+    or not st.session_state.funnel_id
+):
+    st.warning(
+        "Seleziona prima un prodotto e crea un funnel nella pagina 'Selezione Prodotto'."
+    )
+
+    # Pulsante per tornare alla selezione del prodotto
+    st.page_link(
+        "pages/product_selection.py", label="Vai a Selezione Prodotti", icon="🛒"
+    )
+    st.stop()
+
+st.subheader(f"Funnel per: {st.session_state.selected_product_name}")
+
+# Uso di expander per mostrare informazioni tecniche quando necessario
+with st.expander("Dettagli tecnici"):
+    st.write(f"Funnel ID: {st.session_state.funnel_id}")
+    st.write(f"Workflow ID: {st.session_state.workflow_id}")
+
+# Versione delle route della sessione, usata solo nella chiave dell'editor di eliminazione
+st.session_state.setdefault("routes_version", 0)
+
+# Gestione del reset del form
+if "reset_route_form" in st.session_state and st.session_state.reset_route_form:
+    # Resetta i campi del form
+    if "route_config" in st.session_state:
+        del st.session_state["route_config"]
+    st.session_state.reset_route_form = False
+
+# Layout a colonne per una migliore organizzazione
+col1, col2 = st.columns([2, 3])
+
+with col1:
+    # Form per la creazione di una nuova route
+    render_route_form()
+
+    # Guida rapida per la creazione di route
+    with st.expander("📌 Guida rapida"):
+        st.markdown(
+            """
+        ### Come creare un collegamento (route):
+
+        1. **Da Step**: Seleziona lo step di partenza (o "Step iniziale" per l'ingresso nel funnel)
+        2. **A Step**: Seleziona lo step di destinazione (obbligatorio)
+        3. **Configurazione**: Aggiungi una configurazione JSON opzionale per la route
+
+        **Le route definiscono il percorso che l'utente può seguire nel funnel.**
+
+        Per creare un funnel completo:
+        - Inizia con una route dallo step iniziale al primo step
+        - Collega tutti gli step in sequenza
+        - Se necessario, crea percorsi alternativi (branch)
+        """
+        )
+
+with col2:
+    render_existing_routes(
+        st.session_state.workflow_id, st.session_state.routes_version
+    )
+
 # Link di navigazione a fine pagina
 st.divider()
 st.caption("Navigazione:")
@@ -1,17 +1,20 @@
 import copy
-import json
 import logging
+from collections import deque
 
 import pandas as pd
 import streamlit as st
 
+from components.funnel_steps import clear_funnel_steps_cache
 from db.step_operations import (
+    count_steps,
     create_step,
     delete_step,
     get_steps,
     get_steps_for_workflow,
     update_step,
 )
+from utils import json_utils
 from utils.error_handler import handle_error, log_operation
 
 # Configurazione del logging
@@ -20,15 +23,28 @@ logger = logging.getLogger(__name__)
 # Configurazione della pagina
 st.title("Gestione Step del Funnel")
 
+# Limiti per la validazione rapida degli input JSON
+MAX_JSON_INPUT_LENGTH = 1_000_000
+JSON_START_CHARS = frozenset('{["-0123456789tfn')
+
+# Stack di annullamento limitato agli ultimi 10 elementi
+if "undo_stack" not in st.session_state or not isinstance(
+    st.session_state.undo_stack, deque
+):
+    st.session_state.undo_stack = deque(maxlen=10)
+
 
 # Utilizzo di st.cache_data per le operazioni di database
 @st.cache_data(ttl=600)
-def cached_get_steps():
-    """Recupera tutti gli step dal database con caching."""
+def cached_get_steps_page(offset, limit):
+    """Recupera una pagina di step dal database con caching."""
     with st.spinner("Caricamento degli step..."):
         try:
-            steps = get_steps()
-            log_operation("Recupero di tutti gli step", {"count": len(steps)})
+            steps = get_steps(offset=offset, limit=limit)
+            log_operation(
+                "Recupero di una pagina di step",
+                {"offset": offset, "limit": limit, "count": len(steps)},
+            )
             return steps
         except Exception as e:
             return handle_error(
@@ -36,6 +52,17 @@ def cached_get_steps():
             ).get("data", [])
 
 
+@st.cache_data(ttl=600)
+def cached_get_steps_count():
+    """Conta gli step presenti nel database con caching."""
+    try:
+        return count_steps() or 0
+    except Exception as e:
+        return handle_error(
+            e, "Errore durante il conteggio degli step", fallback_data=0
+        ).get("data", 0)
+
+
 @st.cache_data(ttl=600)
 def cached_get_steps_for_workflow(workflow_id):
     """Recupera gli step associati a un workflow specifico con caching."""
@@ -58,32 +85,131 @@ def cached_get_steps_for_workflow(workflow_id):
             ).get("data", [])
 
 
+@st.cache_data(max_entries=128, show_spinner=False)
+def _parse_json_cached(json_string):
+    """
+    Valida un input JSON una sola volta per stringa.
+
+    Returns:
+        tuple: (True, oggetto decodificato) se valido, (False, None)
+            altrimenti. st.cache_data restituisce una copia a ogni chiamata,
+            quindi il chiamante non può alterare il valore in cache.
+    """
+    try:
+        return True, json_utils.loads(json_string)
+    except json_utils.JSONDecodeError:
+        return False, None
+
+
+@st.cache_data(ttl=600)
+def cached_workflow_steps_index(workflow_id):
+    """
+    Restituisce gli step del workflow insieme all'indice id -> step, così il
+    dizionario viene costruito una volta per cache anziché a ogni rerun.
+    """
+    steps = cached_get_steps_for_workflow(workflow_id)
+    return steps, {s["id"]: s for s in steps}
+
+
+def _steps_dataframe_from(steps, columns):
+    """
+    Costruisce il DataFrame degli step limitato alle colonne indicate,
+    passando a pandas un dizionario di colonne anziché una lista di righe.
+    """
+    return pd.DataFrame({col: [s.get(col) for s in steps] for col in columns})
+
+
+@st.cache_data(ttl=600)
+def _steps_dataframe(workflow_id):
+    """DataFrame degli step del workflow, da affettare per la paginazione."""
+    return _steps_dataframe_from(
+        cached_get_steps_for_workflow(workflow_id),
+        ["id", "step_url", "step_code", "post_message"],
+    )
+
+
+@st.cache_data(ttl=600)
+def _all_steps_dataframe(offset, limit):
+    """DataFrame di una pagina di tutti gli step."""
+    return _steps_dataframe_from(
+        cached_get_steps_page(offset, limit), ["id", "step_url", "step_code"]
+    )
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def _pretty_step_json(payload):
+    """
+    Restituisce il JSON indentato di un campo dello step. Il payload fa parte
+    della chiave di cache, così una modifica fatta in un'altra sessione non
+    restituisce il testo vecchio.
+    """
+    return json_utils.dumps(payload, indent=True)
+
+
 def validate_json_input(json_string):
     """Valida un input JSON e restituisce un dizionario o None."""
+    json_string = json_string.strip() if json_string else ""
     if not json_string:
         return None
 
-    try:
-        return json.loads(json_string)
-    except json.JSONDecodeError:
+    # Controlli economici prima del parser: lunghezza e primo carattere
+    if len(json_string) > MAX_JSON_INPUT_LENGTH:
+        return "error"
+    if json_string[0] not in JSON_START_CHARS:
         return "error"
 
+    is_valid, value = _parse_json_cached(json_string)
+    return value if is_valid else "error"
 
-def save_state_for_undo(action_type, step_data):
+
+def _fast_deepcopy(obj):
+    """
+    Copia profonda di dati in formato JSON tramite un round-trip di
+    serializzazione, molto più rapido di copy.deepcopy.
+    """
+    try:
+        return json_utils.loads(json_utils.dumps_bytes(obj))
+    except TypeError:
+        # Valori non serializzabili in JSON: copia tradizionale
+        return copy.deepcopy(obj)
+
+
+def save_state_for_undo(action_type, before, after=None, copy_data=True):
     """
     Salva lo stato corrente per la funzionalità di annullamento.
 
+    Per gli aggiornamenti viene salvato solo il delta dei campi modificati
+    (più l'ID); per le creazioni basta l'ID dello step creato.
+
     Args:
         action_type (str): Il tipo di azione ('create', 'update', 'delete')
-        step_data (dict): I dati dello step coinvolto nell'azione
+        before (dict): I dati dello step prima dell'azione
+        after (dict, optional): I dati aggiornati, per le sole modifiche
+        copy_data (bool): Se False, salva i dati senza copiarli (solo per
+            dizionari appena creati e non condivisi con la cache)
     """
-    # Limita lo stack di annullamento a 10 elementi
-    if len(st.session_state.undo_stack) >= 10:
-        st.session_state.undo_stack.pop(0)
+    # Nessun salvataggio se l'annullamento è disattivato o in anteprima
+    if not st.session_state.get("undo_enabled", True) or st.session_state.get(
+        "preview_mode", False
+    ):
+        return
 
-    # Salva l'operazione corrente
+    if action_type == "create":
+        step_data = {"id": before["id"]}
+    elif action_type == "update" and after is not None:
+        step_data = {
+            "id": before["id"],
+            **{k: before.get(k) for k in after if before.get(k) != after[k]},
+        }
+    else:
+        step_data = before
+
+    if copy_data:
+        step_data = _fast_deepcopy(step_data)
+
+    # Salva l'operazione corrente (la deque scarta da sola la più vecchia)
     st.session_state.undo_stack.append(
-        {"action_type": action_type, "step_data": copy.deepcopy(step_data)}
+        {"action_type": action_type, "step_data": step_data}
     )
 
     logger.debug(
@@ -118,15 +244,6 @@ def handle_step_creation():
         }
         return
 
-    # Raccogliere i dati dello step per la funzionalità di annullamento
-    step_data = {
-        "step_url": st.session_state.step_url,
-        "shopping_cart": shopping_cart,
-        "post_message": st.session_state.step_post_message,
-        "step_code": st.session_state.step_code,
-        "gtm_reference": gtm_reference,
-    }
-
     with st.spinner("Creazione dello step in corso..."):
         # Creazione dello step
         result = create_step(
@@ -140,22 +257,25 @@ def handle_step_creation():
     if not result["error"]:
         # Salva lo stato per l'annullamento
         if "id" in result:
-            step_data["id"] = result["id"]
-            save_state_for_undo("create", step_data)
+            # Per annullare basta l'ID: dizionario nuovo, nessuna copia
+            save_state_for_undo("create", {"id": result["id"]}, copy_data=False)
 
         # Imposta la notifica di successo
         st.session_state.notification = {
             "type": "success",
             "message": result["message"],
         }
-        # Invalida la cache degli step
-        st.session_state.invalidate_step_cache = True
-        # Resetta i campi del form
-        st.session_state.step_url = ""
-        st.session_state.step_shopping_cart = ""
-        st.session_state.step_post_message = False
-        st.session_state.step_code = ""
-        st.session_state.step_gtm_reference = ""
+        # Invalida la cache degli step e resetta i campi del form
+        st.session_state.update(
+            {
+                "invalidate_step_cache": True,
+                "step_url": "",
+                "step_shopping_cart": "",
+                "step_post_message": False,
+                "step_code": "",
+                "step_gtm_reference": "",
+            }
+        )
         # Ricarica la pagina
         st.rerun()
     else:
@@ -163,30 +283,21 @@ def handle_step_creation():
         st.session_state.notification = {"type": "error", "message": result["message"]}
 
 
-def handle_step_update(step_id, updated_data):
+def handle_step_update(step_id, updated_data, original_step):
     """
     Gestisce l'aggiornamento di uno step esistente.
 
     Args:
         step_id (int): ID dello step da aggiornare
         updated_data (dict): Dizionario con i dati aggiornati dello step
+        original_step (dict): Lo step prima della modifica, per l'annullamento
     """
-    # Trova lo step originale per la funzionalità di annullamento
-    original_step = next(
-        (
-            s
-            for s in cached_get_steps_for_workflow(st.session_state.workflow_id)
-            if s["id"] == step_id
-        ),
-        None,
-    )
-
     if not original_step:
         st.error(f"Step con ID {step_id} non trovato")
         return
 
     # Salvare lo stato originale prima dell'aggiornamento
-    save_state_for_undo("update", copy.deepcopy(original_step))
+    save_state_for_undo("update", original_step, updated_data)
 
     with st.spinner(f"Aggiornamento dello step {step_id} in corso..."):
         result = update_step(
@@ -209,29 +320,20 @@ def handle_step_update(step_id, updated_data):
         st.session_state.notification = {"type": "error", "message": result["message"]}
 
 
-def handle_step_delete(step_id):
+def handle_step_delete(step_id, step_to_delete):
     """
     Gestisce l'eliminazione di uno step.
 
     Args:
         step_id (int): ID dello step da eliminare
+        step_to_delete (dict): Lo step da eliminare, per l'annullamento
     """
-    # Trova lo step da eliminare per la funzionalità di annullamento
-    step_to_delete = next(
-        (
-            s
-            for s in cached_get_steps_for_workflow(st.session_state.workflow_id)
-            if s["id"] == step_id
-        ),
-        None,
-    )
-
     if not step_to_delete:
         st.error(f"Step con ID {step_id} non trovato")
         return
 
     # Salvare lo stato prima dell'eliminazione
-    save_state_for_undo("delete", copy.deepcopy(step_to_delete))
+    save_state_for_undo("delete", step_to_delete)
 
     with st.spinner(f"Eliminazione dello step {step_id} in corso..."):
         result = delete_step(step_id)
@@ -266,15 +368,24 @@ def handle_undo_action():
             message = f"Creazione dello step {step_data['id']} annullata"
 
         elif action_type == "update":
-            # Annulla l'aggiornamento ripristinando lo stato precedente
-            result = update_step(
-                step_data["id"],
-                step_data["step_url"],
-                step_data.get("shopping_cart"),
-                step_data.get("post_message"),
-                step_data.get("step_code"),
-                step_data.get("gtm_reference"),
-            )
+            # Annulla l'aggiornamento applicando il delta alla riga attuale
+            _, steps_by_id = cached_workflow_steps_index(st.session_state.workflow_id)
+            current_step = steps_by_id.get(step_data["id"])
+            if current_step is None:
+                result = {
+                    "error": True,
+                    "message": f"Step con ID {step_data['id']} non trovato",
+                }
+            else:
+                restored_step = {**current_step, **step_data}
+                result = update_step(
+                    restored_step["id"],
+                    restored_step["step_url"],
+                    restored_step.get("shopping_cart"),
+                    restored_step.get("post_message"),
+                    restored_step.get("step_code"),
+                    restored_step.get("gtm_reference"),
+                )
             message = f"Modifiche allo step {step_data['id']} annullate"
 
         elif action_type == "delete":
@@ -299,22 +410,153 @@ def handle_undo_action():
         }
 
 
+def render_notification_panel():
+    """
+    Mostra la notifica in sospeso, se presente. Viene richiamata anche dai
+    fragment che modificano lo stato, perché senza st.rerun viene rieseguito
+    solo il fragment.
+    """
+    if "notification" in st.session_state and st.session_state.notification:
+        notification_type = st.session_state.notification["type"]
+        message = st.session_state.notification["message"]
+
+        if notification_type == "success":
+            st.success(message)
+        elif notification_type == "info":
+            st.info(message)
+        elif notification_type == "warning":
+            st.warning(message)
+        elif notification_type == "error":
+            st.error(message)
+
+        # Reset della notifica dopo la visualizzazione
+        st.session_state.notification = None
+
+
+@st.fragment
+def render_undo_sidebar():
+    """
+    Mostra il pulsante "Annulla" se ci sono azioni nello stack. L'annullamento
+    riuscito riesegue l'intera pagina tramite st.rerun.
+    """
+    if st.session_state.undo_stack:
+        if st.button("↩️ Annulla ultima azione", type="secondary"):
+            handle_undo_action()
+            # Un annullamento non riuscito riesegue solo questo fragment
+            render_notification_panel()
+
+
+@st.fragment
+def render_workflow_steps_table():
+    """Mostra la tabella paginata degli step del workflow corrente."""
+    workflow_steps = cached_get_steps_for_workflow(st.session_state.workflow_id)
+
+    # Paginazione per gli step
+    steps_per_page = 5
+    total_pages = (len(workflow_steps) + steps_per_page - 1) // steps_per_page
+
+    if total_pages > 1:
+        col_page, col_info = st.columns([2, 3])
+        with col_page:
+            current_page = st.number_input(
+                "Pagina",
+                min_value=1,
+                max_value=total_pages,
+                value=1,
+                key="steps_current_page",
+            )
+        with col_info:
+            st.info(f"Visualizzazione pagina {current_page} di {total_pages}")
+
+        # Calcola l'indice di inizio e fine per la paginazione
+        start_idx = (current_page - 1) * steps_per_page
+        end_idx = min(start_idx + steps_per_page, len(workflow_steps))
+    else:
+        start_idx, end_idx = 0, len(workflow_steps)
+
+    # DataFrame in cache, affettato per la pagina corrente
+    df_view = _steps_dataframe(st.session_state.workflow_id).iloc[start_idx:end_idx]
+
+    # Limita le colonne per una visualizzazione più chiara
+    if len(df_view.columns) > 0:
+        # Configura le colonne del dataframe
+        column_config = {
+            "id": st.column_config.NumberColumn("ID", help="Identificativo dello step"),
+            "step_url": st.column_config.TextColumn("URL", help="URL dello step"),
+            "step_code": st.column_config.TextColumn(
+                "Codice", help="Codice identificativo"
+            ),
+            "post_message": st.column_config.CheckboxColumn(
+                "Post Message", help="Post message abilitato"
+            ),
+        }
+
+        # Visualizza un dataframe interattivo
+        st.dataframe(
+            df_view,
+            column_config=column_config,
+            use_container_width=True,
+            hide_index=True,
+        )
+
+
+@st.fragment
+def render_all_steps_table():
+    """
+    Mostra la tabella paginata di tutti gli step del database. Il corpo di un
+    expander viene eseguito anche da chiuso, quindi la query parte solo dopo
+    la richiesta esplicita dell'utente.
+    """
+    if not st.session_state.get("show_all_steps", False):
+        if not st.button("Mostra altri step disponibili"):
+            return
+        st.session_state.show_all_steps = True
+
+    all_steps_count = cached_get_steps_count()
+    if all_steps_count:
+        st.write(f"Totale step disponibili: {all_steps_count}")
+
+        # Paginazione per tutti gli step, eseguita dal database
+        all_steps_per_page = 10
+        all_steps_pages = (
+            all_steps_count + all_steps_per_page - 1
+        ) // all_steps_per_page
+
+        if all_steps_pages > 1:
+            col_page, col_info = st.columns([2, 3])
+            with col_page:
+                all_current_page = st.number_input(
+                    "Pagina",
+                    min_value=1,
+                    max_value=all_steps_pages,
+                    value=1,
+                    key="all_steps_current_page",
+                )
+            with col_info:
+                st.info(
+                    f"Visualizzazione pagina {all_current_page} di {all_steps_pages}"
+                )
+        else:
+            all_current_page = 1
+
+        # DataFrame in cache della sola pagina corrente
+        df_all_steps = _all_steps_dataframe(
+            (all_current_page - 1) * all_steps_per_page, all_steps_per_page
+        )
+
+        # Limita le colonne per una visualizzazione più chiara
+        if len(df_all_steps.columns) > 0:
+            st.dataframe(
+                df_all_steps,
+                use_container_width=True,
+                hide_index=True,
+            )
+    else:
+        st.write("Nessuno step disponibile nel database.")
+
+
 # Mostra le notifiche
-if "notification" in st.session_state and st.session_state.notification:
-    notification_type = st.session_state.notification["type"]
-    message = st.session_state.notification["message"]
-
-    if notification_type == "success":
-        st.success(message)
-    elif notification_type == "info":
-        st.info(message)
-    elif notification_type == "warning":
-        st.warning(message)
-    elif notification_type == "error":
-        st.error(message)
-
-    # Reset della notifica dopo la visualizzazione
-    st.session_state.notification = None
+render_notification_panel()
 
 # Verifica se è stato selezionato un prodotto e un funnel
 if not st.session_state.selected_product_id or not st.session_state.funnel_id:
@@ -332,23 +574,35 @@ st.subheader(f"Funnel per: {st.session_state.selected_product_name}")
 
 # Uso di expander per mostrare informazioni tecniche quando necessario
 with st.expander("Dettagli tecnici"):
-    st.write(f"Funnel ID: {st.session_state.funnel_id}")
-    st.write(f"Workflow ID: {st.session_state.workflow_id}")
+    st.write(
+        f"Funnel ID: {st.session_state.funnel_id} · "
+        f"Workflow ID: {st.session_state.workflow_id}"
+    )
 
 # Invalidazione condizionale della cache
 if (
     "invalidate_step_cache" in st.session_state
     and st.session_state.invalidate_step_cache
 ):
-    cached_get_steps.clear()
+    cached_get_steps_page.clear()
+    cached_get_steps_count.clear()
     cached_get_steps_for_workflow.clear()
+    cached_workflow_steps_index.clear()
+    _parse_json_cached.clear()
+    _steps_dataframe.clear()
+    _pretty_step_json.clear()
+    _all_steps_dataframe.clear()
+    # Invalida anche gli step memorizzati dalla configurazione UI
+    clear_funnel_steps_cache()
     st.session_state.invalidate_step_cache = False
 
 # Pulsante "Annulla" se ci sono azioni nello stack
-if "undo_stack" in st.session_state and st.session_state.undo_stack:
-    st.sidebar.button(
-        "↩️ Annulla ultima azione", on_click=handle_undo_action, type="secondary"
-    )
+with st.sidebar:
+    render_undo_sidebar()
+
+# Carica una sola volta per rerun gli step associati al workflow corrente,
+# con l'indice id -> step per lookup O(1) nei selectbox, nei dettagli e nei gestori
+workflow_steps, steps_by_id = cached_workflow_steps_index(st.session_state.workflow_id)
 
 # Layout a colonne per una migliore organizzazione
 col1, col2 = st.columns([2, 3])
@@ -427,82 +681,28 @@ with col1:
         )
 
 with col2:
-    # Carica gli step associati al workflow corrente
-    workflow_steps = cached_get_steps_for_workflow(st.session_state.workflow_id)
-
     if workflow_steps:
         st.subheader(f"Step del Workflow ({len(workflow_steps)})")
 
-        # Paginazione per gli step
-        steps_per_page = 5
-        total_pages = (len(workflow_steps) + steps_per_page - 1) // steps_per_page
-
-        if total_pages > 1:
-            col_page, col_info = st.columns([2, 3])
-            with col_page:
-                current_page = st.number_input(
-                    "Pagina",
-                    min_value=1,
-                    max_value=total_pages,
-                    value=1,
-                    key="steps_current_page",
-                )
-            with col_info:
-                st.info(f"Visualizzazione pagina {current_page} di {total_pages}")
-
-            # Calcola l'indice di inizio e fine per la paginazione
-            start_idx = (current_page - 1) * steps_per_page
-            end_idx = min(start_idx + steps_per_page, len(workflow_steps))
-
-            paginated_steps = workflow_steps[start_idx:end_idx]
-        else:
-            paginated_steps = workflow_steps
-
-        # Utilizza un dataframe interattivo per visualizzare gli step
-        df_steps = pd.DataFrame(paginated_steps)
-        df_view = df_steps.copy()
-
-        # Limita le colonne per una visualizzazione più chiara
-        if len(df_view.columns) > 0:
-            columns_to_display = ["id", "step_url", "step_code", "post_message"]
-            # Assicurati che tutte le colonne esistano nel DataFrame
-            columns_to_display = [
-                col for col in columns_to_display if col in df_view.columns
-            ]
-
-            # Configura le colonne del dataframe
-            column_config = {
-                "id": st.column_config.NumberColumn(
-                    "ID", help="Identificativo dello step"
-                ),
-                "step_url": st.column_config.TextColumn("URL", help="URL dello step"),
-                "step_code": st.column_config.TextColumn(
-                    "Codice", help="Codice identificativo"
-                ),
-                "post_message": st.column_config.CheckboxColumn(
-                    "Post Message", help="Post message abilitato"
-                ),
-            }
-
-            # Visualizza un dataframe interattivo
-            st.dataframe(
-                df_view[columns_to_display],
-                column_config=column_config,
-                use_container_width=True,
-                hide_index=True,
-            )
+        # Tabella paginata in un fragment: il cambio pagina riesegue solo lei
+        render_workflow_steps_table()
 
         # Visualizzazione dettagliata di uno step selezionato
         st.subheader("Dettagli Step")
 
+        # Etichette delle opzioni calcolate una volta per rerun
+        step_labels = {
+            None: "Seleziona uno step...",
+            **{
+                step_id: f"Step {step_id} - {step['step_url']}"
+                for step_id, step in steps_by_id.items()
+            },
+        }
+
         selected_step_id = st.selectbox(
             "Seleziona uno step per vedere i dettagli:",
-            options=[None] + [s["id"] for s in workflow_steps],
-            format_func=lambda x: (
-                "Seleziona uno step..."
-                if x is None
-                else f"Step {x} - {next((s['step_url'] for s in workflow_steps if s['id'] == x), '')}"
-            ),
+            options=list(step_labels),
+            format_func=step_labels.get,
         )
 
         if selected_step_id:
@@ -510,20 +710,25 @@ with col2:
             st.session_state.selected_step_id = selected_step_id
 
             # Trova lo step selezionato
-            selected_step = next(
-                (s for s in workflow_steps if s["id"] == selected_step_id), None
-            )
+            selected_step = steps_by_id.get(selected_step_id)
             if selected_step:
+                # Campi dello step estratti una sola volta
+                step_url = selected_step["step_url"]
+                step_code = selected_step.get("step_code")
+                post_message = selected_step.get("post_message")
+                shopping_cart = selected_step.get("shopping_cart")
+                gtm_reference = selected_step.get("gtm_reference")
+
                 # Mostra i dettagli in un container con bordo
                 with st.container(border=True):
                     col1, col2 = st.columns([3, 1])
 
                     with col1:
-                        st.markdown(f"### {selected_step['step_url']}")
-                        st.caption(f"ID: {selected_step['id']}")
+                        st.markdown(f"### {step_url}")
+                        st.caption(f"ID: {selected_step_id}")
 
                     with col2:
-                        st.metric("Codice", selected_step["step_code"] or "N/A")
+                        st.metric("Codice", step_code or "N/A")
 
                     st.divider()
 
@@ -531,21 +736,23 @@ with col2:
                     with col1:
                         st.write(
                             "**Post message:**",
-                            (
-                                "✅ Abilitato"
-                                if selected_step.get("post_message")
-                                else "❌ Disabilitato"
-                            ),
+                            "✅ Abilitato" if post_message else "❌ Disabilitato",
                         )
 
                     # Visualizzazione delle configurazioni JSON
-                    if selected_step.get("shopping_cart"):
+                    if shopping_cart:
                         with st.expander("Shopping Cart Configuration"):
-                            st.json(selected_step["shopping_cart"])
+                            st.code(
+                                _pretty_step_json(shopping_cart),
+                                language="json",
+                            )
 
-                    if selected_step.get("gtm_reference"):
+                    if gtm_reference:
                         with st.expander("GTM Reference"):
-                            st.json(selected_step["gtm_reference"])
+                            st.code(
+                                _pretty_step_json(gtm_reference),
+                                language="json",
+                            )
 
                     # Aggiungi pulsanti di azione
                     col1, col2 = st.columns(2)
@@ -568,7 +775,7 @@ with col2:
                             col_confirm, col_cancel = st.columns(2)
                             with col_confirm:
                                 if st.button("Sì, elimina", type="primary"):
-                                    handle_step_delete(selected_step_id)
+                                    handle_step_delete(selected_step_id, selected_step)
                                     st.session_state.confirm_delete = False
                             with col_cancel:
                                 if st.button("Annulla"):
@@ -579,25 +786,19 @@ with col2:
                         if st.button("✏️ Modifica"):
                             st.session_state.editing_step = True
                             st.session_state.edit_step_id = selected_step_id
-                            st.session_state.edit_step_url = selected_step["step_url"]
-                            st.session_state.edit_step_code = selected_step.get(
-                                "step_code", ""
-                            )
-                            st.session_state.edit_post_message = selected_step.get(
-                                "post_message", False
-                            )
+                            st.session_state.edit_step_url = step_url
+                            st.session_state.edit_step_code = step_code or ""
+                            st.session_state.edit_post_message = bool(post_message)
+                            # Il form parte sempre dal payload corrente dello step,
+                            # serializzato solo al click
                             st.session_state.edit_shopping_cart = (
-                                json.dumps(
-                                    selected_step.get("shopping_cart", {}), indent=2
-                                )
-                                if selected_step.get("shopping_cart")
+                                json_utils.dumps(shopping_cart, indent=True)
+                                if shopping_cart
                                 else ""
                             )
                             st.session_state.edit_gtm_reference = (
-                                json.dumps(
-                                    selected_step.get("gtm_reference", {}), indent=2
-                                )
-                                if selected_step.get("gtm_reference")
+                                json_utils.dumps(gtm_reference, indent=True)
+                                if gtm_reference
                                 else ""
                             )
 
@@ -657,7 +858,9 @@ with col2:
                                     "gtm_reference": gtm_reference,
                                 }
 
-                                handle_step_update(selected_step_id, updated_data)
+                                handle_step_update(
+                                    selected_step_id, updated_data, selected_step
+                                )
                                 st.session_state.editing_step = False
 
                         with col2:
@@ -670,64 +873,22 @@ with col2:
 
     # Mostra tutti gli step disponibili in un expander
     with st.expander("Altri Step Disponibili"):
-        all_steps = cached_get_steps()
-        if all_steps:
-            st.write(f"Totale step disponibili: {len(all_steps)}")
-
-            # Paginazione per tutti gli step
-            all_steps_per_page = 10
-            all_steps_pages = (
-                len(all_steps) + all_steps_per_page - 1
-            ) // all_steps_per_page
-
-            if all_steps_pages > 1:
-                col_page, col_info = st.columns([2, 3])
-                with col_page:
-                    all_current_page = st.number_input(
-                        "Pagina",
-                        min_value=1,
-                        max_value=all_steps_pages,
-                        value=1,
-                        key="all_steps_current_page",
-                    )
-                with col_info:
-                    st.info(
-                        f"Visualizzazione pagina {all_current_page} di {all_steps_pages}"
-                    )
-
-                # Calcola l'indice di inizio e fine per la paginazione
-                all_start_idx = (all_current_page - 1) * all_steps_per_page
-                all_end_idx = min(all_start_idx + all_steps_per_page, len(all_steps))
-
-                paginated_all_steps = all_steps[all_start_idx:all_end_idx]
-            else:
-                paginated_all_steps = all_steps
-
-            df_all_steps = pd.DataFrame(paginated_all_steps)
-
-            # Limita le colonne per una visualizzazione più chiara
-            if len(df_all_steps.columns) > 0:
-                columns_to_display = ["id", "step_url", "step_code"]
-                # Assicurati che tutte le colonne esistano nel DataFrame
-                columns_to_display = [
-                    col for col in columns_to_display if col in df_all_steps.columns
-                ]
-
-                st.dataframe(
-                    df_all_steps[columns_to_display],
-                    use_container_width=True,
-                    hide_index=True,
-                )
-        else:
-            st.write("Nessuno step disponibile nel database.")
+        render_all_steps_table()
 
 # Modalità anteprima
 with st.sidebar:
     st.subheader("Opzioni di visualizzazione")
     preview_mode = st.checkbox(
         "Modalità Anteprima",
+        key="preview_mode",
         help="Attiva per visualizzare il funnel come lo vedrebbe un utente finale",
     )
+    st.checkbox(
+        "Abilita annulla",
+        value=True,
+        key="undo_enabled",
+        help="Disattiva per non salvare le operazioni nello stack di annullamento",
+    )
     if preview_mode:
         st.info(
             "Modalità anteprima attiva. Le funzionalità di modifica sono disabilitate."
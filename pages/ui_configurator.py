@@ -1,8 +1,9 @@
-import json
-
 import streamlit as st
 
-from db import step_operations, ui_operations
+from components.funnel_steps import cached_funnel_steps
+from db import ui_operations
+from utils import json_utils
+from utils.db_utils import session_scope
 
 # Configurazione della pagina
 st.title("Configurazione UI per Step")
@@ -17,22 +18,31 @@ if "funnel_id" not in st.session_state:
 if "selected_product_name" not in st.session_state:
     st.session_state.selected_product_name = None
 
+
+def render_notification():
+    """
+    Mostra la notifica in sospeso. Viene richiamata anche dai fragment, perché
+    dopo una modifica non riuscita viene rieseguito solo il fragment.
+    """
+    if "notification" in st.session_state and st.session_state.notification:
+        notification_type = st.session_state.notification["type"]
+        message = st.session_state.notification["message"]
+
+        if notification_type == "success":
+            st.success(message)
+        elif notification_type == "info":
+            st.info(message)
+        elif notification_type == "warning":
+            st.warning(message)
+        elif notification_type == "error":
+            st.error(message)
+
+        # Reset della notifica dopo la visualizzazione
+        st.session_state.notification = None
+
+
 # Mostra le notifiche
-if "notification" in st.session_state and st.session_state.notification:
-    notification_type = st.session_state.notification["type"]
-    message = st.session_state.notification["message"]
-
-    if notification_type == "success":
-        st.success(message)
-    elif notification_type == "info":
-        st.info(message)
-    elif notification_type == "warning":
-        st.warning(message)
-    elif notification_type == "error":
-        st.error(message)
-
-    # Reset della notifica dopo la visualizzazione
-    st.session_state.notification = None
+render_notification()
 
 # Inizializzazione delle altre variabili di sessione
 if "sections" not in st.session_state:
@@ -46,121 +56,150 @@ if "current_step_id" not in st.session_state:
 
 
 def load_steps():
-    """Carica gli step dal funnel selezionato"""
+    """Carica gli step dal funnel selezionato con le relative opzioni"""
     if st.session_state.funnel_id:
-        steps = step_operations.get_steps_by_funnel(st.session_state.funnel_id)
-        return steps
-    return []
+        return cached_funnel_steps(st.session_state.funnel_id)
+    return [], {}
+
 
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_sections(_session=None):
+    """Recupera tutte le sezioni dal database con caching"""
+    return ui_operations.get_sections(session=_session)
 
-def load_sections():
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_components(_session=None):
+    """Recupera tutti i componenti dal database con caching"""
+    return ui_operations.get_components(session=_session)
+
+
+def clear_cache():
+    """Svuota le cache delle sezioni e dei componenti dopo una modifica"""
+    _cached_sections.clear()
+    _cached_components.clear()
+
+
+def load_sections(session=None):
     """Carica tutte le sezioni disponibili"""
-    sections = ui_operations.get_sections()
+    sections = _cached_sections(session)
     st.session_state.sections = sections
     return sections
 
 
-def load_components():
+def load_components(session=None):
     """Carica tutti i componenti disponibili"""
-    components = ui_operations.get_components()
+    components = _cached_components(session)
     st.session_state.components = components
     return components
 
 
-def load_sections_for_step(step_id):
+@st.cache_data(ttl=60, show_spinner=False)
+def load_sections_for_step(step_id, product_id, _session=None):
     """Carica le sezioni associate a uno step specifico"""
-    product_id = (
-        st.session_state.selected_product_id
-        if "selected_product_id" in st.session_state
-        else None
+    sections = ui_operations.get_sections_for_step(
+        step_id, product_id=product_id, session=_session
     )
-    sections = ui_operations.get_sections_for_step(step_id, product_id=product_id)
     return sections
 
 
+@st.cache_data(ttl=60, show_spinner=False)
 def load_components_for_section(section_id):
     """Carica i componenti associati a una sezione specifica"""
     components = ui_operations.get_components_for_section(section_id)
     return components
 
 
+@st.cache_data(ttl=60)
+def load_preview_tree(step_id, product_id, include_cms):
+    """Carica in un'unica query i dati dell'anteprima di uno step"""
+    return ui_operations.get_preview_tree(
+        step_id, product_id, include_cms=include_cms
+    )
+
+
+def clear_step_ui_cache():
+    """Svuota le cache di sezioni e componenti associati dopo una modifica"""
+    load_sections_for_step.clear()
+    load_components_for_section.clear()
+    load_preview_tree.clear()
+
+
+def request_app_rerun():
+    """
+    Dopo una modifica riuscita chiede un'unica riesecuzione dell'intera pagina,
+    così l'anteprima e l'altra tab mostrano subito i dati aggiornati.
+    """
+    st.session_state.ui_rerun_app = True
+
+
+def rerun_app_if_requested():
+    """
+    Riesegue l'intera pagina se una modifica lo ha richiesto. Chiamata in testa
+    ai fragment, prima di qualsiasi lettura, così il fragment non viene
+    disegnato due volte.
+    """
+    if st.session_state.pop("ui_rerun_app", False):
+        st.rerun()
+
+
+def _notify(result):
+    """
+    Imposta la notifica in base all'esito di un'operazione.
+
+    Returns:
+        bool: True se l'operazione è andata a buon fine
+    """
+    ok = not result["error"]
+    st.session_state.notification = {
+        "type": "success" if ok else "error",
+        "message": result["message"],
+    }
+    return ok
+
+
 def add_new_section():
     """Aggiunge una nuova sezione al database"""
     if st.session_state.new_section_type:
         result = ui_operations.create_section(st.session_state.new_section_type)
-        if not result["error"]:
-            st.session_state.notification = {
-                "type": "success",
-                "message": result["message"],
-            }
+        if _notify(result):
+            clear_cache()
             load_sections()
-        else:
-            st.session_state.notification = {
-                "type": "error",
-                "message": result["message"],
-            }
+            request_app_rerun()
         st.session_state.new_section_type = ""
-        st.rerun()
 
 
 def add_new_component():
     """Aggiunge un nuovo componente al database"""
     if st.session_state.new_component_type:
         result = ui_operations.create_component(st.session_state.new_component_type)
-        if not result["error"]:
-            st.session_state.notification = {
-                "type": "success",
-                "message": result["message"],
-            }
+        if _notify(result):
+            clear_cache()
             load_components()
-        else:
-            st.session_state.notification = {
-                "type": "error",
-                "message": result["message"],
-            }
+            request_app_rerun()
         st.session_state.new_component_type = ""
-        st.rerun()
 
 
-def add_section_to_step():
-    """Aggiunge una sezione allo step selezionato"""
+def add_section_to_step(step_id, product_id):
+    """Aggiunge la sezione selezionata allo step indicato"""
     if (
-        st.session_state.current_step_id
+        step_id
         and "selected_section" in st.session_state
         and st.session_state.selected_section
     ):
-
-        # Trova l'ultimo ordine esistente e aggiungi 1
-        existing_sections = load_sections_for_step(st.session_state.current_step_id)
-        next_order = 1
-        if existing_sections:
-            orders = [section["order"] for section in existing_sections]
-            next_order = max(orders) + 1 if orders else 1
-
-        product_id = (
-            st.session_state.selected_product_id
-            if "selected_product_id" in st.session_state
-            else None
-        )
+        # Ultimo ordine esistente + 1, calcolato dal database
+        next_order = ui_operations.next_section_order(step_id, product_id)
 
         result = ui_operations.add_section_to_step(
-            st.session_state.current_step_id,
+            step_id,
             st.session_state.selected_section,
             next_order,
             product_id=product_id,
         )
 
-        if not result["error"]:
-            st.session_state.notification = {
-                "type": "success",
-                "message": result["message"],
-            }
-        else:
-            st.session_state.notification = {
-                "type": "error",
-                "message": result["message"],
-            }
-        st.rerun()
+        if _notify(result):
+            clear_step_ui_cache()
+            request_app_rerun()
 
 
 def add_component_to_section():
@@ -172,14 +211,10 @@ def add_component_to_section():
         and st.session_state.selected_component
     ):
 
-        # Trova l'ultimo ordine esistente e aggiungi 1
-        existing_components = load_components_for_section(
+        # Ultimo ordine esistente + 1, calcolato dal database
+        next_order = ui_operations.next_component_order(
             st.session_state.selected_section_id
         )
-        next_order = 1
-        if existing_components:
-            orders = [component["order"] for component in existing_components]
-            next_order = max(orders) + 1 if orders else 1
 
         result = ui_operations.add_component_to_section(
             st.session_state.selected_section_id,
@@ -187,30 +222,17 @@ def add_component_to_section():
             next_order,
         )
 
-        if not result["error"]:
-            st.session_state.notification = {
-                "type": "success",
-                "message": result["message"],
-            }
-        else:
-            st.session_state.notification = {
-                "type": "error",
-                "message": result["message"],
-            }
-        st.rerun()
+        if _notify(result):
+            clear_step_ui_cache()
+            request_app_rerun()
 
 
 def update_section_order(section_id, new_order):
     """Aggiorna l'ordine di una sezione"""
     result = ui_operations.update_step_section_order(section_id, new_order)
-    if not result["error"]:
-        st.session_state.notification = {
-            "type": "success",
-            "message": result["message"],
-        }
-    else:
-        st.session_state.notification = {"type": "error", "message": result["message"]}
-    st.rerun()
+    if _notify(result):
+        clear_step_ui_cache()
+        request_app_rerun()
 
 
 def update_component_order(component_section_id, new_order):
@@ -218,53 +240,33 @@ def update_component_order(component_section_id, new_order):
     result = ui_operations.update_component_section_order(
         component_section_id, new_order
     )
-    if not result["error"]:
-        st.session_state.notification = {
-            "type": "success",
-            "message": result["message"],
-        }
-    else:
-        st.session_state.notification = {"type": "error", "message": result["message"]}
-    st.rerun()
+    if _notify(result):
+        clear_step_ui_cache()
+        request_app_rerun()
 
 
 def delete_section_from_step(step_section_id):
     """Elimina una sezione da uno step"""
     result = ui_operations.delete_step_section(step_section_id)
-    if not result["error"]:
-        st.session_state.notification = {
-            "type": "success",
-            "message": result["message"],
-        }
-    else:
-        st.session_state.notification = {"type": "error", "message": result["message"]}
-    st.rerun()
+    if _notify(result):
+        clear_step_ui_cache()
+        request_app_rerun()
 
 
 def delete_component_from_section(component_section_id):
     """Elimina un componente da una sezione"""
     result = ui_operations.delete_component_section(component_section_id)
-    if not result["error"]:
-        st.session_state.notification = {
-            "type": "success",
-            "message": result["message"],
-        }
-    else:
-        st.session_state.notification = {"type": "error", "message": result["message"]}
-    st.rerun()
+    if _notify(result):
+        clear_step_ui_cache()
+        request_app_rerun()
 
 
 def update_structure_data(structure_id, new_data):
     """Aggiorna i dati di una struttura"""
     result = ui_operations.update_structure_data(structure_id, new_data)
-    if not result["error"]:
-        st.session_state.notification = {
-            "type": "success",
-            "message": result["message"],
-        }
-    else:
-        st.session_state.notification = {"type": "error", "message": result["message"]}
-    st.rerun()
+    if _notify(result):
+        clear_step_ui_cache()
+        request_app_rerun()
 
 
 def save_cms_key(structure_component_section_id, cms_data):
@@ -272,314 +274,277 @@ def save_cms_key(structure_component_section_id, cms_data):
     result = ui_operations.create_or_update_cms_key(
         structure_component_section_id, cms_data
     )
-    if not result["error"]:
-        st.session_state.notification = {
-            "type": "success",
-            "message": result["message"],
-        }
-    else:
-        st.session_state.notification = {"type": "error", "message": result["message"]}
-    st.rerun()
-
-
-# Verifica se è stato selezionato un prodotto e un funnel
-if not st.session_state.selected_product_id or not st.session_state.funnel_id:
-    st.warning(
-        "Seleziona prima un prodotto e crea un funnel nella pagina 'Selezione Prodotto'."
-    )
+    if _notify(result):
+        clear_step_ui_cache()
+        request_app_rerun()
+
+
+@st.fragment
+def render_sections_tab(step_id, product_id):
+    """
+    Mostra la tab di gestione delle sezioni. Essendo un fragment, le
+    interazioni rieseguono solo questa tab; le modifiche riuscite rieseguono
+    una volta l'intera pagina.
+
+    Args:
+        step_id (int): ID dello step selezionato
+        product_id (int): ID del prodotto selezionato
+    """
+    rerun_app_if_requested()
+    render_notification()
+
+    # Letture della tab con un'unica sessione (usata solo se la cache è scaduta)
+    step_sections = []
+    with session_scope() as session:
+        all_sections = load_sections(session)
+        if step_id:
+            step_sections = load_sections_for_step(step_id, product_id, session)
+
+    st.subheader("Gestione Sezioni")
+
+    if step_id:
+        # Sezione per aggiungere nuove sezioni al database
+        with st.expander("Aggiungi nuova sezione"):
+            st.text_input(
+                "Tipo di sezione",
+                key="new_section_type",
+                placeholder="Es. header, footer, form, results",
+            )
+            st.button("Aggiungi sezione al database", on_click=add_new_section)
 
-    # Pulsante per tornare alla selezione del prodotto
-    st.page_link(
-        "pages/product_selection.py", label="Vai a Selezione Prodotti", icon="🛒"
-    )
-    st.stop()
+        # Selezione delle sezioni esistenti da aggiungere allo step
+        section_labels = {
+            section["id"]: section["sectiontype"] for section in all_sections
+        }
 
-st.subheader(f"Personalizzazione UI per: {st.session_state.selected_product_name}")
+        # Le opzioni sono gli ID: la sezione selezionata è già in session_state
+        st.selectbox(
+            "Seleziona una sezione da aggiungere:",
+            options=list(section_labels),
+            format_func=section_labels.get,
+            key="selected_section",
+        )
 
-# Caricamento dei dati
-steps = load_steps()
-all_sections = load_sections()
-all_components = load_components()
+        # Pulsante per aggiungere la sezione selezionata allo step
+        st.button(
+            "Aggiungi sezione allo step",
+            on_click=add_section_to_step,
+            args=(step_id, product_id),
+        )
 
-# Layout a due colonne per la selezione dello step e la configurazione
-col1, col2 = st.columns([1, 2])
+        # Mostra le sezioni già associate allo step
+        st.subheader("Sezioni configurate per questo step")
 
-with col1:
-    with st.container(border=True):
-        st.subheader("Selezione Step")
+        if step_sections:
+            for section in step_sections:
+                with st.container(border=True):
+                    col1, col2, col3 = st.columns([3, 1, 1])
 
-        # Selezione degli step dal funnel
-        step_options = [(f"{step['order']}. {step['name']}") for step in steps]
-        step_values = [step["id"] for step in steps]
+                    with col1:
+                        st.write(f"**{section['sectiontype']}**")
+                        st.caption(f"Ordine: {section['order']}")
 
-        if step_options:
-            step_index = 0
-            if st.session_state.current_step_id:
-                try:
-                    step_index = step_values.index(st.session_state.current_step_id)
-                except ValueError:
-                    step_index = 0
+                        # Set section_id in session state when the section is selected
+                        if st.button(
+                            f"Seleziona",
+                            key=f"select_section_{section['step_section_id']}",
+                        ):
+                            st.session_state.selected_section_id = section["id"]
+                            st.rerun()
+
+                    with col2:
+                        # Pulsanti per riordinare la sezione
+                        st.button(
+                            "↑",
+                            key=f"up_{section['step_section_id']}",
+                            help="Sposta su",
+                            on_click=update_section_order,
+                            args=(
+                                section["step_section_id"],
+                                max(1, section["order"] - 1),
+                            ),
+                        )
 
-            selected_step_name = st.selectbox(
-                "Seleziona uno step da personalizzare:",
-                options=step_options,
-                index=step_index,
-                key="ui_step_selector",
-                help="Seleziona lo step per cui vuoi configurare l'interfaccia utente",
-            )
+                        st.button(
+                            "↓",
+                            key=f"down_{section['step_section_id']}",
+                            help="Sposta giù",
+                            on_click=update_section_order,
+                            args=(section["step_section_id"], section["order"] + 1),
+                        )
 
-            # Aggiorna l'ID dello step corrente
-            selected_step_index = step_options.index(selected_step_name)
-            st.session_state.current_step_id = step_values[selected_step_index]
+                    with col3:
+                        # Pulsante per eliminare la sezione dallo step
+                        st.button(
+                            "🗑️",
+                            key=f"delete_{section['step_section_id']}",
+                            help="Elimina sezione",
+                            on_click=delete_section_from_step,
+                            args=(section["step_section_id"],),
+                        )
         else:
-            st.warning("Nessuno step trovato nel funnel selezionato.")
-
-with col2:
-    # Tabs per organizzare le diverse sezioni di configurazione
-    tab1, tab2 = st.tabs(["Sezioni", "Componenti"])
-
-    with tab1:
-        st.subheader("Gestione Sezioni")
-
-        if st.session_state.current_step_id:
-            # Sezione per aggiungere nuove sezioni al database
-            with st.expander("Aggiungi nuova sezione"):
-                st.text_input(
-                    "Tipo di sezione",
-                    key="new_section_type",
-                    placeholder="Es. header, footer, form, results",
-                )
-                st.button("Aggiungi sezione al database", on_click=add_new_section)
-
-            # Selezione delle sezioni esistenti da aggiungere allo step
-            section_options = [section["sectiontype"] for section in all_sections]
-            section_ids = [section["id"] for section in all_sections]
-
-            st.selectbox(
-                "Seleziona una sezione da aggiungere:",
-                options=section_options,
-                key="selected_section_display",
+            st.info(
+                "Nessuna sezione configurata per questo step. Aggiungi una sezione."
             )
-
-            # Mappa il nome della sezione selezionata all'ID
-            if (
-                "selected_section_display" in st.session_state
-                and st.session_state.selected_section_display
-            ):
-                try:
-                    index = section_options.index(
-                        st.session_state.selected_section_display
-                    )
-                    st.session_state.selected_section = section_ids[index]
-                except ValueError:
-                    st.session_state.selected_section = None
-
-            # Pulsante per aggiungere la sezione selezionata allo step
-            st.button("Aggiungi sezione allo step", on_click=add_section_to_step)
-
-            # Mostra le sezioni già associate allo step
-            st.subheader("Sezioni configurate per questo step")
-            step_sections = load_sections_for_step(st.session_state.current_step_id)
-
-            if step_sections:
-                for section in step_sections:
-                    with st.container(border=True):
-                        col1, col2, col3 = st.columns([3, 1, 1])
-
-                        with col1:
-                            st.write(f"**{section['sectiontype']}**")
-                            st.caption(f"Ordine: {section['order']}")
-
-                            # Set section_id in session state when the section is selected
-                            if st.button(
-                                f"Seleziona",
-                                key=f"select_section_{section['step_section_id']}",
-                            ):
-                                st.session_state.selected_section_id = section["id"]
-                                st.rerun()
-
-                        with col2:
-                            # Pulsanti per riordinare la sezione
-                            st.button(
-                                "↑",
-                                key=f"up_{section['step_section_id']}",
-                                help="Sposta su",
-                                on_click=update_section_order,
-                                args=(
-                                    section["step_section_id"],
-                                    max(1, section["order"] - 1),
-                                ),
-                            )
-
-                            st.button(
-                                "↓",
-                                key=f"down_{section['step_section_id']}",
-                                help="Sposta giù",
-                                on_click=update_section_order,
-                                args=(section["step_section_id"], section["order"] + 1),
-                            )
-
-                        with col3:
-                            # Pulsante per eliminare la sezione dallo step
-                            st.button(
-                                "🗑️",
-                                key=f"delete_{section['step_section_id']}",
-                                help="Elimina sezione",
-                                on_click=delete_section_from_step,
-                                args=(section["step_section_id"],),
-                            )
-            else:
-                st.info(
-                    "Nessuna sezione configurata per questo step. Aggiungi una sezione."
-                )
-        else:
-            st.info("Seleziona uno step per gestire le sezioni.")
-
-    with tab2:
-        st.subheader("Gestione Componenti")
-
-        # Verifica se è stata selezionata una sezione
-        if (
-            "selected_section_id" in st.session_state
-            and st.session_state.selected_section_id
-        ):
-            # Recupera il tipo di sezione
-            section_type = next(
-                (
-                    s["sectiontype"]
-                    for s in all_sections
-                    if s["id"] == st.session_state.selected_section_id
-                ),
-                "Sezione",
+    else:
+        st.info("Seleziona uno step per gestire le sezioni.")
+
+
+@st.fragment
+def render_components_tab():
+    """
+    Mostra la tab di gestione dei componenti della sezione selezionata.
+    Essendo un fragment, le interazioni rieseguono solo questa tab; le
+    modifiche riuscite rieseguono una volta l'intera pagina.
+    """
+    rerun_app_if_requested()
+    render_notification()
+
+    # Letture della tab con un'unica sessione (usata solo se la cache è scaduta)
+    section_components = []
+    with session_scope() as session:
+        all_sections = load_sections(session)
+        all_components = load_components(session)
+        if st.session_state.get("selected_section_id"):
+            # Le chiavi CMS arrivano già con i componenti, dalla stessa cache
+            section_components = load_components_for_section(
+                st.session_state.selected_section_id
             )
-            st.caption(f"Configurazione componenti per: {section_type}")
-
-            # Sezione per aggiungere nuovi componenti al database
-            with st.expander("Aggiungi nuovo componente"):
-                st.text_input(
-                    "Tipo di componente",
-                    key="new_component_type",
-                    placeholder="Es. title, text, image, button, form, table, chart",
-                )
-                st.button("Aggiungi componente al database", on_click=add_new_component)
 
-            # Selezione dei componenti esistenti da aggiungere alla sezione
-            component_options = [
-                component["component_type"] for component in all_components
-            ]
-            component_ids = [component["id"] for component in all_components]
+    st.subheader("Gestione Componenti")
 
-            st.selectbox(
-                "Seleziona un componente da aggiungere:",
-                options=component_options,
-                key="selected_component_display",
+    # Verifica se è stata selezionata una sezione
+    if (
+        "selected_section_id" in st.session_state
+        and st.session_state.selected_section_id
+    ):
+        # Recupera il tipo di sezione
+        section_type = next(
+            (
+                s["sectiontype"]
+                for s in all_sections
+                if s["id"] == st.session_state.selected_section_id
+            ),
+            "Sezione",
+        )
+        st.caption(f"Configurazione componenti per: {section_type}")
+
+        # Sezione per aggiungere nuovi componenti al database
+        with st.expander("Aggiungi nuovo componente"):
+            st.text_input(
+                "Tipo di componente",
+                key="new_component_type",
+                placeholder="Es. title, text, image, button, form, table, chart",
             )
+            st.button("Aggiungi componente al database", on_click=add_new_component)
 
-            # Mappa il nome del componente selezionato all'ID
-            if (
-                "selected_component_display" in st.session_state
-                and st.session_state.selected_component_display
-            ):
-                try:
-                    index = component_options.index(
-                        st.session_state.selected_component_display
-                    )
-                    st.session_state.selected_component = component_ids[index]
-                except ValueError:
-                    st.session_state.selected_component = None
-
-            # Pulsante per aggiungere il componente selezionato alla sezione
-            st.button(
-                "Aggiungi componente alla sezione", on_click=add_component_to_section
-            )
+        # Selezione dei componenti esistenti da aggiungere alla sezione
+        component_labels = {
+            component["id"]: component["component_type"]
+            for component in all_components
+        }
 
-            # Mostra i componenti già associati alla sezione
-            st.subheader("Componenti configurati per questa sezione")
-            section_components = load_components_for_section(
-                st.session_state.selected_section_id
-            )
+        # Le opzioni sono gli ID: il componente selezionato è già in session_state
+        st.selectbox(
+            "Seleziona un componente da aggiungere:",
+            options=list(component_labels),
+            format_func=component_labels.get,
+            key="selected_component",
+        )
 
-            if section_components:
-                for component in section_components:
-                    with st.container(border=True):
-                        st.write(f"**{component['component_type']}**")
-                        st.caption(f"Ordine: {component['order']}")
-
-                        # Visualizza e modifica la struttura JSON del componente
-                        with st.expander("Definizione Structure JSON", expanded=True):
-                            st.info(
-                                "La structure definisce la configurazione del componente Angular. "
-                                "Ogni tipo di componente richiede una struttura JSON specifica."
-                            )
+        # Pulsante per aggiungere il componente selezionato alla sezione
+        st.button(
+            "Aggiungi componente alla sezione", on_click=add_component_to_section
+        )
 
-                            # Mostra un esempio di struttura in base al tipo di componente
-                            component_type = component["component_type"]
-                            example = {}
+        # Mostra i componenti già associati alla sezione
+        st.subheader("Componenti configurati per questa sezione")
 
-                            if component_type == "button":
-                                example = {
-                                    "text": "Pulsante di esempio",
-                                    "action": "submit",
-                                    "style": {
-                                        "color": "primary",
-                                        "size": "medium"
-                                    }
+        if section_components:
+            for component in section_components:
+                with st.container(border=True):
+                    st.write(f"**{component['component_type']}**")
+                    st.caption(f"Ordine: {component['order']}")
+
+                    # Visualizza e modifica la struttura JSON del componente
+                    with st.expander("Definizione Structure JSON", expanded=True):
+                        st.info(
+                            "La structure definisce la configurazione del componente Angular. "
+                            "Ogni tipo di componente richiede una struttura JSON specifica."
+                        )
+
+                        # Mostra un esempio di struttura in base al tipo di componente
+                        component_type = component["component_type"]
+                        example = {}
+
+                        if component_type == "button":
+                            example = {
+                                "text": "Pulsante di esempio",
+                                "action": "submit",
+                                "style": {
+                                    "color": "primary",
+                                    "size": "medium"
                                 }
-                            elif component_type == "text":
-                                example = {
-                                    "content": "Testo di esempio",
-                                    "markdown": True,
-                                    "style": {
-                                        "fontSize": "16px",
-                                        "color": "#333333"
-                                    }
+                            }
+                        elif component_type == "text":
+                            example = {
+                                "content": "Testo di esempio",
+                                "markdown": True,
+                                "style": {
+                                    "fontSize": "16px",
+                                    "color": "#333333"
                                 }
-                            elif component_type == "image":
-                                example = {
-                                    "url": "https://example.com/image.jpg",
-                                    "alt": "Descrizione immagine",
-                                    "style": {
-                                        "width": "100%",
-                                        "borderRadius": "4px"
-                                    }
+                            }
+                        elif component_type == "image":
+                            example = {
+                                "url": "https://example.com/image.jpg",
+                                "alt": "Descrizione immagine",
+                                "style": {
+                                    "width": "100%",
+                                    "borderRadius": "4px"
                                 }
-                            elif component_type == "form":
-                                example = {
-                                    "fields": [
-                                        {
-                                            "name": "email",
-                                            "type": "email",
-                                            "label": "Indirizzo email",
-                                            "required": True
-                                        },
-                                        {
-                                            "name": "name",
-                                            "type": "text",
-                                            "label": "Nome completo"
-                                        }
-                                    ],
-                                    "submitButton": {
-                                        "text": "Invia",
-                                        "style": {
-                                            "color": "primary"
-                                        }
+                            }
+                        elif component_type == "form":
+                            example = {
+                                "fields": [
+                                    {
+                                        "name": "email",
+                                        "type": "email",
+                                        "label": "Indirizzo email",
+                                        "required": True
+                                    },
+                                    {
+                                        "name": "name",
+                                        "type": "text",
+                                        "label": "Nome completo"
+                                    }
+                                ],
+                                "submitButton": {
+                                    "text": "Invia",
+                                    "style": {
+                                        "color": "primary"
                                     }
                                 }
+                            }
 
-                            # Mostra l'esempio
-                            st.write("**Esempio di structure per questo componente:**")
-                            st.json(example)
+                        # Mostra l'esempio
+                        st.write("**Esempio di structure per questo componente:**")
+                        st.json(example)
 
-                            # Crea una chiave univoca per l'editor JSON
-                            json_key = f"json_{component['component_section_id']}"
+                        # Crea una chiave univoca per l'editor JSON
+                        json_key = f"json_{component['component_section_id']}"
 
-                            # Inizializza la chiave di sessione se non esiste
-                            if json_key not in st.session_state:
-                                current_structure = component["structure"] if component["structure"] else {}
-                                st.session_state[json_key] = json.dumps(current_structure, indent=2)
+                        # Inizializza la chiave di sessione se non esiste
+                        if json_key not in st.session_state:
+                            st.session_state[json_key] = component["structure_json"] or "{}"
 
-                            # Editor JSON
-                            st.write("**Definisci la structure JSON:**")
+                        # Editor JSON in un form: le modifiche non rieseguono la
+                        # pagina finché non si salva
+                        st.write("**Definisci la structure JSON:**")
+                        with st.form(
+                            f"json_form_{component['component_section_id']}",
+                            clear_on_submit=False,
+                        ):
                             json_str = st.text_area(
                                 "",
                                 value=st.session_state[json_key],
@@ -587,45 +552,45 @@ with col2:
                                 key=f"json_edit_{component['component_section_id']}",
                             )
 
-                            # Aggiorna il valore nella sessione
-                            st.session_state[json_key] = json_str
-
                             # Pulsante per salvare le modifiche alla struttura
-                            if st.button(
-                                "Salva struttura",
-                                key=f"save_json_{component['component_section_id']}",
-                            ):
-                                try:
-                                    json_data = json.loads(json_str)
-                                    update_structure_data(
-                                        component["structure_id"], json_data
-                                    )
-                                except json.JSONDecodeError:
-                                    st.error(
-                                        "JSON non valido. Controlla la sintassi."
-                                    )
-
-                        # Configurazione delle chiavi CMS
-                        with st.expander("Configurazione CMS"):
-                            # Ottieni la configurazione CMS esistente
-                            cms_key = None
-                            if component["structure_component_section_id"]:
-                                cms_key = ui_operations.get_cms_key_for_structure(
-                                    component["structure_component_section_id"]
+                            save_structure = st.form_submit_button("Salva struttura")
+
+                        # Aggiorna il valore nella sessione
+                        st.session_state[json_key] = json_str
+
+                        if save_structure:
+                            try:
+                                json_data = json_utils.loads(json_str)
+                                update_structure_data(
+                                    component["structure_id"], json_data
+                                )
+                                # Salvataggio fuori da un callback: st.rerun() ha
+                                # effetto subito; in caso di errore resta la notifica
+                                rerun_app_if_requested()
+                                render_notification()
+                            except json_utils.JSONDecodeError:
+                                st.error(
+                                    "JSON non valido. Controlla la sintassi."
                                 )
 
-                            cms_json_key = f"cms_{component['component_section_id']}"
+                    # Configurazione delle chiavi CMS
+                    with st.expander("Configurazione CMS"):
+                        cms_json_key = f"cms_{component['component_section_id']}"
 
-                            # Inizializza la chiave di sessione con il valore esistente o vuoto
-                            if cms_json_key not in st.session_state:
-                                if cms_key and "value" in cms_key:
-                                    st.session_state[cms_json_key] = json.dumps(
-                                        cms_key["value"], indent=2
-                                    )
-                                else:
-                                    st.session_state[cms_json_key] = "{}"
+                        # Inizializza la chiave di sessione con il valore esistente o vuoto
+                        if cms_json_key not in st.session_state:
+                            if component["cms_key_id"] is not None:
+                                st.session_state[cms_json_key] = json_utils.dumps(
+                                    component["cms_key"], indent=True
+                                )
+                            else:
+                                st.session_state[cms_json_key] = "{}"
 
-                            # Editor JSON per la chiave CMS
+                        # Editor JSON per la chiave CMS, anch'esso in un form
+                        with st.form(
+                            f"cms_form_{component['component_section_id']}",
+                            clear_on_submit=False,
+                        ):
                             cms_json_str = st.text_area(
                                 "Chiavi CMS (JSON):",
                                 value=st.session_state[cms_json_key],
@@ -633,122 +598,187 @@ with col2:
                                 key=f"cms_edit_{component['component_section_id']}",
                             )
 
-                            # Aggiorna il valore nella sessione
-                            st.session_state[cms_json_key] = cms_json_str
-
                             # Pulsante per salvare le modifiche alla chiave CMS
-                            if st.button(
-                                "Salva configurazione CMS",
-                                key=f"save_cms_{component['component_section_id']}",
-                            ):
-                                try:
-                                    cms_data = json.loads(cms_json_str)
-                                    save_cms_key(
-                                        component["structure_component_section_id"],
-                                        cms_data,
-                                    )
-                                except json.JSONDecodeError:
-                                    st.error("JSON non valido. Controlla la sintassi.")
-
-                        # Azioni per il componente
-                        col1, col2, col3 = st.columns(3)
-
-                        with col1:
-                            # Pulsanti per riordinare il componente
-                            st.button(
-                                "↑",
-                                key=f"up_comp_{component['component_section_id']}",
-                                help="Sposta su",
-                                on_click=update_component_order,
-                                args=(
-                                    component["component_section_id"],
-                                    max(1, component["order"] - 1),
-                                ),
-                            )
+                            save_cms = st.form_submit_button("Salva configurazione CMS")
 
-                        with col2:
-                            st.button(
-                                "↓",
-                                key=f"down_comp_{component['component_section_id']}",
-                                help="Sposta giù",
-                                on_click=update_component_order,
-                                args=(
-                                    component["component_section_id"],
-                                    component["order"] + 1,
-                                ),
-                            )
+                        # Aggiorna il valore nella sessione
+                        st.session_state[cms_json_key] = cms_json_str
 
-                        with col3:
-                            # Pulsante per eliminare il componente dalla sezione
-                            st.button(
-                                "🗑️",
-                                key=f"delete_comp_{component['component_section_id']}",
-                                help="Elimina componente",
-                                on_click=delete_component_from_section,
-                                args=(component["component_section_id"],),
-                            )
-            else:
-                st.info(
-                    "Nessun componente configurato per questa sezione. Aggiungi un componente."
-                )
+                        if save_cms:
+                            try:
+                                cms_data = json_utils.loads(cms_json_str)
+                                save_cms_key(
+                                    component["structure_component_section_id"],
+                                    cms_data,
+                                )
+                                rerun_app_if_requested()
+                                render_notification()
+                            except json_utils.JSONDecodeError:
+                                st.error("JSON non valido. Controlla la sintassi.")
+
+                    # Azioni per il componente
+                    col1, col2, col3 = st.columns(3)
+
+                    with col1:
+                        # Pulsanti per riordinare il componente
+                        st.button(
+                            "↑",
+                            key=f"up_comp_{component['component_section_id']}",
+                            help="Sposta su",
+                            on_click=update_component_order,
+                            args=(
+                                component["component_section_id"],
+                                max(1, component["order"] - 1),
+                            ),
+                        )
+
+                    with col2:
+                        st.button(
+                            "↓",
+                            key=f"down_comp_{component['component_section_id']}",
+                            help="Sposta giù",
+                            on_click=update_component_order,
+                            args=(
+                                component["component_section_id"],
+                                component["order"] + 1,
+                            ),
+                        )
+
+                    with col3:
+                        # Pulsante per eliminare il componente dalla sezione
+                        st.button(
+                            "🗑️",
+                            key=f"delete_comp_{component['component_section_id']}",
+                            help="Elimina componente",
+                            on_click=delete_component_from_section,
+                            args=(component["component_section_id"],),
+                        )
         else:
             st.info(
-                "Seleziona prima una sezione dalla tab 'Sezioni' per gestire i componenti."
+                "Nessun componente configurato per questa sezione. Aggiungi un componente."
             )
+    else:
+        st.info(
+            "Seleziona prima una sezione dalla tab 'Sezioni' per gestire i componenti."
+        )
 
-    # Fine della sezione componenti
 
-# Anteprima dell'interfaccia
-st.subheader("Anteprima")
-with st.expander("Mostra anteprima", expanded=True):
-    # Verifica se è stato selezionato uno step
-    if st.session_state.current_step_id:
-        # Carica le sezioni per lo step
-        step_sections = load_sections_for_step(st.session_state.current_step_id)
+@st.fragment
+def render_preview(step_id, product_id):
+    """Mostra l'anteprima dell'interfaccia per lo step selezionato"""
 
-        if step_sections:
-            st.caption("Anteprima dell'interfaccia utente per lo step selezionato")
+    # Le chiavi CMS vengono recuperate solo se richieste
+    show_cms = st.checkbox(
+        "Mostra dati CMS nell'anteprima", value=False, key="show_cms_preview"
+    )
 
-            # Crea un container per ogni sezione nell'ordine corretto
-            for section in sorted(step_sections, key=lambda x: x["order"]):
-                with st.container(border=True):
-                    st.write(f"### Sezione: {section['sectiontype']}")
+    with st.expander("Mostra anteprima", expanded=True):
+        # Verifica se è stato selezionato uno step
+        if step_id:
+            # Carica sezioni, componenti e chiavi CMS con un'unica query
+            preview_tree = load_preview_tree(step_id, product_id, show_cms)
 
-                    # Carica i componenti per questa sezione
-                    section_components = load_components_for_section(section["id"])
+            if preview_tree:
+                st.caption("Anteprima dell'interfaccia utente per lo step selezionato")
 
-                    if section_components:
-                        for component in sorted(
-                            section_components, key=lambda x: x["order"]
-                        ):
-                            st.write(f"**Componente: {component['component_type']}**")
+                # Crea un container per ogni sezione nell'ordine corretto
+                for section in preview_tree:
+                    with st.container(border=True):
+                        st.write(f"### Sezione: {section['sectiontype']}")
 
-                            # Mostra i dati della struttura se disponibili
-                            if component["structure"]:
-                                st.json(component["structure"])
+                        if section["components"]:
+                            for component in section["components"]:
+                                st.write(f"**Componente: {component['component_type']}**")
 
-                            # Mostra la chiave CMS se disponibile
-                            if component["structure_component_section_id"]:
-                                cms_key = ui_operations.get_cms_key_for_structure(
-                                    component["structure_component_section_id"]
-                                )
-                                if cms_key and "value" in cms_key:
+                                # Mostra i dati della struttura se disponibili
+                                if component["structure"]:
+                                    st.json(component["structure"])
+
+                                # Mostra la chiave CMS se disponibile
+                                if show_cms and component["cms_key_id"] is not None:
                                     st.caption("Dati CMS:")
-                                    st.json(cms_key["value"])
-                    else:
-                        st.caption(
-                            "Nessun componente in questa sezione. Aggiungi componenti dalla tab 'Componenti'."
-                        )
+                                    st.json(component["cms_key"])
+                        else:
+                            st.caption(
+                                "Nessun componente in questa sezione. Aggiungi componenti dalla tab 'Componenti'."
+                            )
+            else:
+                st.info(
+                    "Nessuna sezione configurata per questo step. Aggiungi sezioni dalla tab 'Sezioni'."
+                )
         else:
-            st.info(
-                "Nessuna sezione configurata per questo step. Aggiungi sezioni dalla tab 'Sezioni'."
-            )
-    else:
-        st.info("Seleziona uno step per visualizzare l'anteprima.")
+            st.info("Seleziona uno step per visualizzare l'anteprima.")
+
+        st.caption(
+            "Nota: questa è una visualizzazione semplificata dell'interfaccia. Nel frontend reale, i componenti saranno renderizzati correttamente in base alla loro configurazione."
+        )
+
+
+# Verifica se è stato selezionato un prodotto e un funnel
+if not st.session_state.selected_product_id or not st.session_state.funnel_id:
+    st.warning(
+        "Seleziona prima un prodotto e crea un funnel nella pagina 'Selezione Prodotto'."
+    )
 
-    st.caption(
-        "Nota: questa è una visualizzazione semplificata dell'interfaccia. Nel frontend reale, i componenti saranno renderizzati correttamente in base alla loro configurazione."
+    # Pulsante per tornare alla selezione del prodotto
+    st.page_link(
+        "pages/product_selection.py", label="Vai a Selezione Prodotti", icon="🛒"
     )
+    st.stop()
+
+st.subheader(f"Personalizzazione UI per: {st.session_state.selected_product_name}")
+
+# Letti una volta per esecuzione e passati esplicitamente ai fragment
+product_id = st.session_state.selected_product_id
+
+# Caricamento dei dati (sezioni e componenti vengono caricati dai fragment)
+steps, step_labels = load_steps()
+
+# Layout a due colonne per la selezione dello step e la configurazione
+col1, col2 = st.columns([1, 2])
+
+with col1:
+    with st.container(border=True):
+        st.subheader("Selezione Step")
+
+        # Selezione degli step dal funnel: le opzioni sono gli ID degli step
+        if step_labels:
+            # Preseleziona lo step corrente, o il primo se non appartiene al funnel
+            if st.session_state.get("ui_step_selector") not in step_labels:
+                st.session_state.ui_step_selector = (
+                    st.session_state.current_step_id
+                    if st.session_state.current_step_id in step_labels
+                    else next(iter(step_labels))
+                )
+
+            st.selectbox(
+                "Seleziona uno step da personalizzare:",
+                options=list(step_labels),
+                format_func=step_labels.get,
+                key="ui_step_selector",
+                help="Seleziona lo step per cui vuoi configurare l'interfaccia utente",
+            )
+
+            # Aggiorna l'ID dello step corrente
+            st.session_state.current_step_id = st.session_state.ui_step_selector
+        else:
+            st.warning("Nessuno step trovato nel funnel selezionato.")
+
+step_id = st.session_state.current_step_id
+
+with col2:
+    # Tabs per organizzare le diverse sezioni di configurazione
+    tab1, tab2 = st.tabs(["Sezioni", "Componenti"])
+
+    with tab1:
+        render_sections_tab(step_id, product_id)
+
+    with tab2:
+        render_components_tab()
+
+# Anteprima dell'interfaccia
+st.subheader("Anteprima")
+render_preview(step_id, product_id)
 
 # Nota informativa finale
 st.info(
@@ -3,19 +3,121 @@ Configurazione per i test con pytest.
 """
 import pytest
 import os
+from pathlib import Path
 
-@pytest.fixture
-def funnel_id():
+from utils import json_utils
+
+# Cartella dei risultati, creata una sola volta all'import del modulo
+_TEST_DIR = Path(__file__).parent / "test_results"
+_TEST_DIR.mkdir(exist_ok=True)
+
+# Con PRETTY_JSON impostata i file vengono indentati per la lettura in debug
+_PRETTY_JSON = bool(os.getenv("PRETTY_JSON"))
+
+
+def pytest_configure(config):
+    """Registra il marker xdist_group anche quando pytest-xdist non è installato."""
+    config.addinivalue_line(
+        "markers", "xdist_group(name): esegue i test dello stesso gruppo sullo stesso worker"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    """
+    Raggruppa per funnel i test parametrizzati su funnel_id.
+
+    Con `pytest -n auto --dist loadgroup` i test sullo stesso funnel restano sullo
+    stesso worker, evitando scritture concorrenti sugli stessi dati, mentre
+    funnel diversi vengono eseguiti in parallelo.
+    """
+    for item in items:
+        callspec = getattr(item, "callspec", None)
+        if callspec is not None and "funnel_id" in callspec.params:
+            item.add_marker(
+                pytest.mark.xdist_group(name=f"funnel-{callspec.params['funnel_id']}")
+            )
+
+
+def pytest_addoption(parser):
+    """Aggiunge l'opzione --funnel-id alla riga di comando di pytest."""
+    parser.addoption(
+        "--funnel-id",
+        action="store",
+        default=None,
+        help=(
+            "ID dei funnel da utilizzare nei test, separati da virgola "
+            "(ha precedenza su TEST_FUNNEL_IDS e TEST_FUNNEL_ID)"
+        ),
+    )
+
+
+def _funnel_ids(config):
+    """
+    Restituisce gli ID dei funnel da testare, letti da un'unica fonte.
+
+    Ordine di precedenza: opzione --funnel-id, variabile TEST_FUNNEL_IDS,
+    variabile TEST_FUNNEL_ID, altrimenti l'ID di default (1). Più ID vanno
+    separati da virgola (es. --funnel-id 1,2,3).
+    """
+    raw_ids = (
+        config.getoption("--funnel-id")
+        or os.environ.get("TEST_FUNNEL_IDS")
+        or os.environ.get("TEST_FUNNEL_ID")
+        or "1"
+    )
+    return [int(funnel_id) for funnel_id in raw_ids.split(",")]
+
+
+def pytest_generate_tests(metafunc):
     """
-    Fixture che fornisce un ID di funnel valido per i test.
+    Parametrizza su funnel_id ogni test che lo richiede, anche tramite fixture.
 
-    Può essere sovrascritto passando la variabile d'ambiente TEST_FUNNEL_ID.
-    Altrimenti, utilizza un ID di default (1).
+    Lo scope di sessione fa sì che le fixture di sessione (es. exported_funnel)
+    vengano eseguite una sola volta per funnel.
     """
-    # Controlla se è stata specificata una variabile d'ambiente
-    env_funnel_id = os.environ.get('TEST_FUNNEL_ID')
-    if env_funnel_id:
-        return int(env_funnel_id)
+    if "funnel_id" in metafunc.fixturenames:
+        metafunc.parametrize("funnel_id", _funnel_ids(metafunc.config), scope="session")
+
+
+@pytest.fixture(scope="session")
+def results_dir():
+    """Cartella condivisa in cui i test salvano i file esportati."""
+    return _TEST_DIR
+
+
+@pytest.fixture(scope="session")
+def pretty_json():
+    """True se i file JSON dei test vanno indentati (variabile PRETTY_JSON)."""
+    return _PRETTY_JSON
+
+
+@pytest.fixture(scope="session")
+def exported_funnel(funnel_id):
+    """
+    Fixture che esporta il funnel una sola volta per l'intera sessione di test.
+
+    I test che modificano i dati esportati devono lavorare su una copia.
+    """
+    # Import locale: i test che non usano il database non richiedono la connessione
+    from utils.export_import import export_funnel_config
+
+    return export_funnel_config(funnel_id)
+
+
+@pytest.fixture(scope="session")
+def exported_funnel_file(exported_funnel, funnel_id, results_dir, pretty_json):
+    """
+    Fixture che salva una sola volta il funnel esportato su file.
+
+    Il file viene scritto solo se è impostata KEEP_ORIGINAL_EXPORT. Restituisce
+    il percorso del file, o None se non è stato scritto.
+    """
+    if not os.getenv("KEEP_ORIGINAL_EXPORT") or exported_funnel.get("error", True):
+        return None
+
+    temp_file = results_dir / f"temp_funnel_{funnel_id}.json"
+
+    # Serializzazione compatta (orjson se disponibile) scritta in un'unica operazione
+    temp_file.write_bytes(json_utils.dumps_bytes(exported_funnel["data"], indent=pretty_json))
 
-    # Altrimenti, utilizza un ID di default
-    return 1
\ No newline at end of file
+    return temp_file
@@ -7,14 +7,48 @@ from unittest.mock import MagicMock, patch
 
 from utils.db_transaction import standardized_db_operation, log_db_operation, with_retry
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
 
 
-def test_standardized_db_operation():
+@pytest.fixture(scope="module")
+def session_spec():
+    """
+    Attributi dell'interfaccia di Session, calcolati una sola volta per il modulo.
+    """
+    return dir(Session)
+
+
+@pytest.fixture
+def mock_session(session_spec):
+    """
+    Sessione mock vincolata all'interfaccia di Session.
+
+    Viene creata una nuova istanza per ogni test: una copia di un mock condiviso
+    condividerebbe anche i mock figli e quindi il conteggio delle chiamate.
+    """
+    return MagicMock(spec=session_spec)
+
+
+@pytest.fixture
+def patched_session(monkeypatch, mock_session):
+    """
+    Sostituisce le funzioni di sessione usate dal decoratore con dei mock.
+
+    Returns:
+        tuple: Sessione mock e mock di close_db_session
+    """
+    monkeypatch.setattr("utils.db_transaction.get_db_session", lambda: mock_session)
+    close_mock = MagicMock()
+    monkeypatch.setattr("utils.db_transaction.close_db_session", close_mock)
+    return mock_session, close_mock
+
+
+def test_standardized_db_operation(patched_session):
     """
     Verifica che il decoratore standardized_db_operation funzioni correttamente.
     """
-    # Mock della sessione
-    mock_session = MagicMock()
+    # Mock della sessione e della chiusura
+    mock_session, mock_close = patched_session
     
     # Funzione di test
     @standardized_db_operation("test operation")
@@ -24,49 +58,43 @@ def test_standardized_db_operation():
         assert arg2 == "optional"
         return {"success": True}
     
-    # Patch delle funzioni utilizzate dal decoratore
-    with patch("utils.db_transaction.get_db_session", return_value=mock_session):
-        with patch("utils.db_transaction.close_db_session") as mock_close:
-            # Esegui la funzione
-            result = test_function("test", arg2="optional")
-            
-            # Verifica che la sessione sia stata gestita correttamente
-            mock_session.begin.assert_called_once()
-            mock_session.commit.assert_called_once()
-            mock_close.assert_called_once_with(mock_session)
-            
-            # Verifica il risultato
-            assert result == {"success": True}
-
-
-def test_standardized_db_operation_with_exception():
+    # Esegui la funzione
+    result = test_function("test", arg2="optional")
+    
+    # Verifica che la sessione sia stata gestita correttamente
+    mock_session.begin.assert_called_once()
+    mock_session.commit.assert_called_once()
+    mock_close.assert_called_once_with(mock_session)
+    
+    # Verifica il risultato
+    assert result == {"success": True}
+
+
+def test_standardized_db_operation_with_exception(patched_session):
     """
     Verifica che il decoratore standardized_db_operation gestisca correttamente le eccezioni.
     """
-    # Mock della sessione
-    mock_session = MagicMock()
+    # Mock della sessione e della chiusura
+    mock_session, mock_close = patched_session
     
     # Funzione di test che solleva un'eccezione
     @standardized_db_operation("test operation with exception")
     def test_function_with_exception(session):
         raise ValueError("Test exception")
     
-    # Patch delle funzioni utilizzate dal decoratore
-    with patch("utils.db_transaction.get_db_session", return_value=mock_session):
-        with patch("utils.db_transaction.close_db_session") as mock_close:
-            # Esegui la funzione
-            result = test_function_with_exception()
-            
-            # Verifica che la sessione sia stata gestita correttamente
-            mock_session.begin.assert_called_once()
-            mock_session.commit.assert_not_called()
-            mock_session.rollback.assert_called_once()
-            mock_close.assert_called_once_with(mock_session)
-            
-            # Verifica il risultato
-            assert result["error"] is True
-            assert "Test exception" in result["message"]
-            assert result["error_type"] == "general"
+    # Esegui la funzione
+    result = test_function_with_exception()
+    
+    # Verifica che la sessione sia stata gestita correttamente
+    mock_session.begin.assert_called_once()
+    mock_session.commit.assert_not_called()
+    mock_session.rollback.assert_called_once()
+    mock_close.assert_called_once_with(mock_session)
+    
+    # Verifica il risultato
+    assert result["error"] is True
+    assert "Test exception" in result["message"]
+    assert result["error_type"] == "general"
 
 
 def test_with_retry():
@@ -75,9 +103,11 @@ def test_with_retry():
     """
     # Contatore per tenere traccia del numero di chiamate
     call_count = 0
+    # Attese richieste tra i tentativi (nessuna attesa reale)
+    delays = []
     
     # Funzione di test che fallisce le prime due volte
-    @with_retry(max_attempts=3, retry_delay=0.01)
+    @with_retry(max_attempts=3, retry_delay=0.01, sleep_fn=delays.append)
     def test_function_with_retry():
         nonlocal call_count
         call_count += 1
@@ -86,27 +116,34 @@ def test_with_retry():
         return "success"
     
     # Esegui la funzione
-    with patch("utils.db_transaction.time.sleep"):  # Evita i ritardi nei test
-        result = test_function_with_retry()
+    result = test_function_with_retry()
     
     # Verifica che la funzione sia stata chiamata il numero corretto di volte
     assert call_count == 3
     assert result == "success"
+    
+    # Verifica il backoff esponenziale tra i tentativi
+    assert delays == [0.01, 0.02]
 
 
 def test_with_retry_all_attempts_fail():
     """
     Verifica che il decoratore with_retry sollevi l'eccezione se tutti i tentativi falliscono.
     """
+    # Attese richieste tra i tentativi (nessuna attesa reale)
+    delays = []
+    
     # Funzione di test che fallisce sempre
-    @with_retry(max_attempts=3, retry_delay=0.01)
+    @with_retry(max_attempts=3, retry_delay=0.01, sleep_fn=delays.append)
     def test_function_always_fails():
         raise OperationalError("Test retry failure", None, None)
     
     # Esegui la funzione e verifica che sollevi l'eccezione
-    with patch("utils.db_transaction.time.sleep"):  # Evita i ritardi nei test
-        with pytest.raises(OperationalError):
-            test_function_always_fails()
+    with pytest.raises(OperationalError):
+        test_function_always_fails()
+    
+    # Nessuna attesa dopo l'ultimo tentativo
+    assert delays == [0.01, 0.02]
 
 
 def test_log_db_operation():
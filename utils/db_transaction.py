@@ -86,13 +86,15 @@ def standardized_db_operation(operation_name):
     return decorator
 
 
-def with_retry(max_attempts=3, retry_delay=0.5):
+def with_retry(max_attempts=3, retry_delay=0.5, sleep_fn=time.sleep):
     """
     Decorator per riprovare operazioni di database in caso di errori di connessione.
     
     Args:
         max_attempts (int): Numero massimo di tentativi
-        retry_delay (float): Ritardo tra i tentativi in secondi
+        retry_delay (float): Ritardo iniziale tra i tentativi in secondi, raddoppiato
+            a ogni nuovo tentativo
+        sleep_fn (callable): Funzione usata per attendere tra i tentativi
         
     Returns:
         function: Funzione decorata
@@ -107,11 +109,16 @@ def with_retry(max_attempts=3, retry_delay=0.5):
                     return func(*args, **kwargs)
                 except (OperationalError, TimeoutError) as e:
                     last_exception = e
+                    if attempt == max_attempts:
+                        break
+
+                    # Backoff esponenziale: retry_delay, 2 * retry_delay, ...
+                    delay = retry_delay * 2 ** (attempt - 1)
                     logger.warning(
                         f"Tentativo {attempt}/{max_attempts} fallito: {str(e)}. "
-                        f"Riprovo tra {retry_delay} secondi..."
+                        f"Riprovo tra {delay} secondi..."
                     )
-                    time.sleep(retry_delay)
+                    sleep_fn(delay)
             
             # Se arriviamo qui, tutti i tentativi sono falliti
             logger.error(f"Tutti i {max_attempts} tentativi falliti: {str(last_exception)}")
@@ -1,5 +1,6 @@
 import logging
 import os
+from contextlib import contextmanager
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 from dotenv import load_dotenv
@@ -7,7 +8,9 @@ from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import QueuePool
+from sqlalchemy.util import LRUCache
 
+from utils import json_utils
 from utils.error_handler import log_operation
 
 # Configurazione del logging
@@ -36,8 +39,15 @@ engine = create_engine(
     pool_recycle=1800,  # Ricicla le connessioni dopo 30 minuti
     pool_pre_ping=True,  # Verifica che la connessione sia attiva prima dell'uso
     echo=False,  # Imposta su True solo in sviluppo per loggare le query SQL
+    # Le colonne JSON/JSONB vengono decodificate con orjson; la serializzazione
+    # resta quella standard, che accetta anche dict con chiavi non stringa
+    json_deserializer=json_utils.loads,
 )
 
+# Cache delle query compilate per le letture frequenti in sola lettura
+# (usata tramite execution_options(compiled_cache=...))
+compiled_cache = LRUCache(100)
+
 # Creazione della sessione factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -57,6 +67,23 @@ def get_db_session():
         raise
 
 
+@contextmanager
+def session_scope():
+    """Apre una sessione da condividere tra più letture e la chiude all'uscita.
+
+    La connessione viene presa dal pool solo alla prima query, quindi aprire
+    una sessione che non esegue query non ha costi.
+
+    Yields:
+        Session: Una sessione SQLAlchemy.
+    """
+    session = get_db_session()
+    try:
+        yield session
+    finally:
+        close_db_session(session)
+
+
 def close_db_session(session):
     """Chiude una sessione del database.
 
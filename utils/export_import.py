@@ -11,6 +11,7 @@ import pandas as pd
 from sqlalchemy import select, text
 
 from db.models import Funnel, Product, Route, Step, Workflow
+from db.route_operations import clear_routes_cache
 from utils.db_utils import close_db_session, get_db_session, optimize_query_execution
 from utils.error_handler import handle_error, log_operation
 
@@ -1049,6 +1050,8 @@ def import_funnel_config(
 
         # Commit della transazione
         session.commit()
+        # Le route del workflow importato non devono restare in cache
+        clear_routes_cache()
 
         import_result = {
             "error": False,
@@ -0,0 +1,68 @@
+"""
+Modulo con funzioni di serializzazione JSON veloci.
+
+Utilizza orjson quando disponibile e ricade sul modulo json della libreria
+standard in caso contrario, mantenendo la stessa interfaccia.
+"""
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    orjson = None
+
+# orjson.JSONDecodeError è una sottoclasse di json.JSONDecodeError, quindi
+# un unico except copre entrambi i parser
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """
+    Decodifica un documento JSON.
+
+    Args:
+        data: Documento JSON come stringa o bytes
+
+    Returns:
+        Any: L'oggetto Python decodificato
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def dumps(obj: Any, indent: bool = False) -> str:
+    """
+    Serializza un oggetto in una stringa JSON.
+
+    Args:
+        obj: Oggetto da serializzare
+        indent: Se True, indenta l'output con due spazi
+
+    Returns:
+        str: La stringa JSON
+    """
+    return dumps_bytes(obj, indent).decode("utf-8")
+
+
+def dumps_bytes(obj: Any, indent: bool = False) -> bytes:
+    """
+    Serializza un oggetto in bytes JSON codificati in UTF-8.
+
+    Args:
+        obj: Oggetto da serializzare
+        indent: Se True, indenta l'output con due spazi
+
+    Returns:
+        bytes: Il documento JSON codificato in UTF-8
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    if indent:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+    # Separatori compatti, come l'output di orjson
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")